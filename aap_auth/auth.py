@@ -6,6 +6,8 @@ from cryptography.hazmat.backends import default_backend
 import os
 import requests
 
+from gifts_rest.http_client import http_client
+
 class AAPAcess(object):
     """
     Singleton object to access the AAP service
@@ -70,7 +72,7 @@ class AAPAcess(object):
         pem_filename = settings.AAP_PEM_FILE
 
         #log Fetching PEM certificate from AAP service
-        r = requests.get(settings.AAP_PEM_URL)
+        r = http_client.get(settings.AAP_PEM_URL)
 
         if r.status_code != requests.codes.ok:
             raise Exception("Unable to fetch AAP PEM certificate")
@@ -104,7 +106,7 @@ class AAPAcess(object):
         headers = {"Authorization": "Bearer {}".format(token),
                    "Content-Type": "application/json;charset=UTF-8"}
     
-        r = requests.get(settings.AAP_PROFILE_URL.format(elixir_id), headers=headers)
+        r = http_client.get(settings.AAP_PROFILE_URL.format(elixir_id), headers=headers)
     
         if r.status_code != requests.codes.ok:
             raise Exception("Error fetching profile, status: {}".format(r.status_code))
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+#
+# Status codes worth retrying, and the methods which can be (the POST
+# endpoints of Ensembl REST are batch lookups, hence safe to repeat)
+#
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_METHODS = frozenset(['HEAD', 'GET', 'OPTIONS', 'POST'])
+
+# deadline of the requests made by the current thread, see HTTPClient.deadline
+_local = threading.local()
+
+def current_deadline():
+    return getattr(_local, 'deadline', None)
+
+
+class DeadlineRetry(Retry):
+    """
+    Retry, unless the deadline of the calling thread would have passed by the end of the backoff
+    """
+
+    def is_exhausted(self):
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() <= self.get_backoff_time():
+            return True
+
+        return super(DeadlineRetry, self).is_exhausted()
+
+
+class HTTPClient(object):
+    """
+    HTTP client shared by the calls to the external services (Ensembl REST,
+    TaRK, AAP).
+
+    Connections are kept alive in per-host pools, every request has connect
+    and read timeouts and is retried with exponential backoff on connection
+    errors and transient server errors. Within deadline(), the timeouts and
+    the retries are also bounded by the time remaining. The number of requests,
+    errors and the time spent are recorded per host, see stats(), and logged
+    every stats_interval seconds.
+    """
+
+    def __init__(self, connect_timeout, read_timeout, retries=3, backoff_factor=0.5, pool_size=10, stats_interval=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats_interval = stats_interval
+
+        # urllib3 < 1.26 names allowed_methods method_whitelist
+        methods_option = 'allowed_methods' if hasattr(Retry, 'DEFAULT_ALLOWED_METHODS') else 'method_whitelist'
+        retry = DeadlineRetry(total=retries,
+                              backoff_factor=backoff_factor,
+                              status_forcelist=RETRY_STATUSES,
+                              raise_on_status=False,
+                              **{ methods_option: RETRY_METHODS })
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: { 'requests': 0, 'errors': 0, 'time': 0.0, 'max_time': 0.0 })
+        self._stats_logged = time.monotonic()
+
+    def _record(self, host, elapsed, error):
+        with self._lock:
+            host_stats = self._stats[host]
+            host_stats['requests'] += 1
+            host_stats['time'] += elapsed
+            host_stats['max_time'] = max(host_stats['max_time'], elapsed)
+            if error:
+                host_stats['errors'] += 1
+
+            now = time.monotonic()
+            log_stats = self.stats_interval is not None and self._stats_logged + self.stats_interval <= now
+            if log_stats:
+                self._stats_logged = now
+
+        if log_stats:
+            self.log_stats()
+
+    def log_stats(self):
+        """
+        Log the per-host counters of stats()
+        """
+
+        for host, host_stats in sorted(self.stats().items()):
+            logger.info("%s: %d requests, %d errors, %.3fs mean, %.3fs max, %.1fs total",
+                        host, host_stats['requests'], host_stats['errors'], host_stats['mean_time'],
+                        host_stats['max_time'], host_stats['time'])
+
+    @contextmanager
+    def deadline(self, deadline):
+        """
+        Bound the requests made by the current thread within the block by
+        the given deadline (see restui.lib.concurrency.Deadline): they time
+        out when it passes and aren't retried beyond it
+        """
+
+        outer = current_deadline()
+        _local.deadline = deadline
+        try:
+            yield
+        finally:
+            _local.deadline = outer
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+
+        deadline = current_deadline()
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if not remaining:
+                raise requests.Timeout("Deadline passed before requesting {}".format(url))
+            timeouts = kwargs['timeout'] if isinstance(kwargs['timeout'], tuple) else (kwargs['timeout'],) * 2
+            kwargs['timeout'] = tuple( min(timeout, remaining) for timeout in timeouts )
+
+        host = urlsplit(url).netloc
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record(host, time.monotonic() - start, error=True)
+            raise
+
+        self._record(host, time.monotonic() - start, error=not response.ok)
+
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """
+        Return the per-host counters: number of requests, failed ones and
+        total/mean/max time in seconds (retries included)
+        """
+
+        with self._lock:
+            return { host: dict(host_stats, mean_time=host_stats['time'] / host_stats['requests'])
+                     for host, host_stats in self._stats.items() }
+
+http_client = HTTPClient(connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+                         read_timeout=settings.HTTP_READ_TIMEOUT,
+                         retries=settings.HTTP_RETRIES,
+                         backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+                         pool_size=settings.HTTP_POOL_SIZE,
+                         stats_interval=settings.HTTP_STATS_LOG_INTERVAL)
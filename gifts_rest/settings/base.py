@@ -54,7 +54,7 @@ INSTALLED_APPS = [
     'rest_framework_swagger',
     'django.contrib.postgres',
     'psqlextra',
-    'restui',
+    'restui.apps.RestuiConfig',
     'aap_auth.apps.AppAuthConfig'
 ]
      
@@ -75,6 +75,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'restui.middleware.DifferencesScopeMiddleware',
 ]
 
 if DEBUG is True:
@@ -212,6 +213,84 @@ TARK_SERVER = "http://betatark.ensembl.org"
 # Ensembl REST server
 ENSEMBL_REST_SERVER = "http://rest.ensembl.org"
 
+# Mapping search cache (grouping counts and facets per search),
+# max number of searches and time to live in seconds
+SEARCH_CACHE_SIZE = 512
+SEARCH_CACHE_TTL = 300
+# Max number of groups of a search for its counts to be cached,
+# i.e. bounds the memory taken by each cached search
+SEARCH_CACHE_MAX_GROUPS = 5000
+
+# Above this (estimated) number of groups, browsing the mappings with
+# no search term reports an estimated count, unless exactCount=true
+SEARCH_EXACT_COUNT_THRESHOLD = 10000
+
+# Time to live (seconds) of the in-process taxonomy registry,
+# reloaded anyway whenever a species history completes loading
+TAXONOMY_REGISTRY_TTL = 3600
+
+# Time to live (seconds) of the in-process search suggestions index,
+# rebuilt anyway whenever a species history completes loading
+SUGGEST_INDEX_TTL = 6 * 3600
+
+# Build the suggestions index in the background when the WSGI worker
+# serves its first request (see gifts_rest/wsgi.py), otherwise on the first
+# suggest request (answered with no suggestions until built)
+SUGGEST_INDEX_PRELOAD = False
+
+# Mapping detail documents cache: the in-process tier is short lived as it
+# can serve documents invalidated by another process, the Redis tier (if a
+# URL is given, e.g. 'redis://localhost:6379/1') is shared by all of them
+MAPPING_DETAIL_CACHE_SIZE = 1024
+MAPPING_DETAIL_CACHE_LOCAL_TTL = 60
+MAPPING_DETAIL_CACHE_TTL = 3600
+MAPPING_DETAIL_CACHE_REDIS_URL = None
+
+# Time to live (seconds) of the current Ensembl release number, and size of
+# the in-process caches of the ENST->ENSP lookups and of the sequences
+ENSEMBL_RELEASE_TTL = 3600
+ENSEMBL_LOOKUP_CACHE_SIZE = 10000
+ENSEMBL_SEQUENCE_CACHE_SIZE = 2000
+
+# Number of IDs per request to the Ensembl REST POST /lookup/id and
+# /sequence/id endpoints (the maximum they accept)
+ENSEMBL_LOOKUP_BATCH_SIZE = 1000
+ENSEMBL_SEQUENCE_BATCH_SIZE = 50
+
+# Calls to the external services (see gifts_rest.http_client): timeouts (seconds),
+# retries with exponential backoff and size of the per-host connection pools
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 30
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_POOL_SIZE = 10
+# Interval (seconds) at which each process logs the per-host statistics
+# of its calls (requests, errors, time spent), None to disable
+HTTP_STATS_LOG_INTERVAL = 600
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'process': { 'format': '%(asctime)s [%(process)d] %(name)s %(levelname)s %(message)s' },
+    },
+    'handlers': {
+        'console': { 'class': 'logging.StreamHandler', 'formatter': 'process' },
+    },
+    'loggers': {
+        'gifts_rest.http_client': { 'handlers': ['console'], 'level': 'INFO', 'propagate': False },
+    },
+}
+
+# Number of threads running the remote calls of the requests concurrently
+# (at most HTTP_POOL_SIZE), and how long (seconds) a request waits for them
+REMOTE_CALLS_WORKERS = 10
+REMOTE_CALLS_DEADLINE = 10
+
+# Local store (SQLite file) of the Ensembl sequences, filled with the
+# populate_sequence_store command and read on REST lookups. None to disable
+SEQUENCE_STORE_PATH = None
+
 # AAP service
 AAP_PEM_URL = 'https://api.aai.ebi.ac.uk/meta/public.pem'
 AAP_PROFILE_URL = 'https://api.aai.ebi.ac.uk/users/{}/profile'
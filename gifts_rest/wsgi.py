@@ -14,9 +14,30 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gifts_rest.settings")
 
 env_variables_to_pass = ['DJANGO_ENVIRONMENT', ]
+
+_preloaded = False
+def preload():
+    """
+    Start warming up the in-process indexes of the worker, once, only in the
+    server processes (not in the management commands, shells or tests)
+    """
+    global _preloaded
+    if _preloaded:
+        return
+    _preloaded = True
+
+    from django.conf import settings
+    from restui.lib.suggest import suggest_index
+
+    if settings.SUGGEST_INDEX_PRELOAD:
+        suggest_index.preload()
+
 def application(environ, start_response):
     # pass the WSGI environment variables on through to os.environ
     for var in env_variables_to_pass:
         os.environ[var] = environ.get(var, '')
         
-    return get_wsgi_application()(environ, start_response)
+    handler = get_wsgi_application()
+    preload()
+
+    return handler(environ, start_response)
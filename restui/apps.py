@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class RestuiConfig(AppConfig):
     name = 'restui'
+
+    def ready(self):
+        """
+        Connect the signal handlers keeping the in-process registries up to date
+        """
+
+        import restui.signals
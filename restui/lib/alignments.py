@@ -1,58 +1,172 @@
-from restui.lib.external import ensembl_sequence, ensembl_protein
+import logging
+from collections import defaultdict
+
+from django.db import DatabaseError
+from django.utils import timezone
+from psqlextra.query import ConflictAction
+
+from restui.lib.concurrency import Deadline, gather, submit
+from restui.lib.external import ensembl_sequences
+from restui.lib.identifiers import resolve_proteins
+from restui.models.ensembl import EnspUPairwise
 from sam_alignment_reconstructor.pairwise import pairwise_alignment, cigar_split
 
-def fetch_pairwise(mapping):
-    
-    pairwise_alignments = []
-    
-    enst = mapping.transcript.enst_id
-    uniprot_id = mapping.uniprot.uniprot_acc
-    
+logger = logging.getLogger(__name__)
+
+def pairwise_alignments_used(mapping):
+    """
+    Return the alignments of the mapping rendered as pairwise alignments:
+    the first identity alignment if any, else the perfect matches
+    """
+
+    alignments = []
     for alignment in mapping.alignments.all():
         if alignment.alignment_run.score1_type == 'identity':
-            cigarplus = alignment.pairwise.cigarplus
-            mdz = alignment.pairwise.mdz
-            
-            if mdz.startswith('MD:Z:'):
-                mdz = mdz[len('MD:Z:'):]
-            
-            ens_release = alignment.alignment_run.ensembl_release
-
-            ensp = ensembl_protein(enst, ens_release)
-            seq = ensembl_sequence(ensp, ens_release)
-            
-            uniprot_seq, match_str, ensembl_seq = pairwise_alignment(seq, cigarplus, mdz)
-            
-            pairwise_alignments.append({'uniprot_alignment': uniprot_seq,
-                                        'ensembl_alignment': ensembl_seq,
-                                        'match_str': match_str,
-                                        'alignment_id': alignment.alignment_id,
-                                        'ensembl_release': ens_release,
-                                        'ensembl_id': ensp,
-                                        'uniprot_id': uniprot_id,
-                                        'alignment_type': 'identity'})
+            alignments.append(alignment)
 
             # Break out of the loop, we're done
             break
 
         elif alignment.alignment_run.score1_type == 'perfect_match' and alignment.score1 == 1:
-            ens_release = alignment.alignment_run.ensembl_release
-
-            ensp = ensembl_protein(enst, ens_release)
-            seq = ensembl_sequence(ensp, ens_release)
-            
-            pairwise_alignments.append({'uniprot_alignment': seq,
-                                        'ensembl_alignment': seq,
-                                        'match_str': '|' * len(seq),
+            alignments.append(alignment)
+
+    return alignments
+
+def fetch_release_sequences(enst_ids, ens_release):
+    """
+    Return the proteins of the given transcripts in the given release and their sequences
+    """
+
+    proteins = resolve_proteins(enst_ids, ens_release)
+
+    return proteins, ensembl_sequences(proteins.values(), ens_release)
+
+def rendered_pairwise(alignment_ids):
+    """
+    Return a dict of the already rendered pairwise alignments of the given alignments
+    """
+
+    if not alignment_ids:
+        return {}
+
+    return { rendered.alignment_id: rendered for rendered in EnspUPairwise.objects.filter(alignment_id__in=alignment_ids) }
+
+def store_rendered_pairwise(rendered):
+    """
+    Store the given rendered pairwise alignments, unless already there
+    """
+
+    if not rendered:
+        return
+
+    try:
+        EnspUPairwise.objects.on_conflict(['alignment'], ConflictAction.NOTHING).bulk_insert(
+            [ { 'alignment_id': r.alignment_id,
+                'ensp_id': r.ensp_id,
+                'alignment_type': r.alignment_type,
+                'uniprot_alignment': r.uniprot_alignment,
+                'ensembl_alignment': r.ensembl_alignment,
+                'match_str': r.match_str,
+                'time_rendered': r.time_rendered } for r in rendered ])
+    except DatabaseError as e:
+        logger.warning("Cannot store %d rendered pairwise alignments: %s", len(rendered), e)
+
+def render_pairwise(alignment, ensp, seq):
+    """
+    Render the pairwise alignment of the given alignment and Ensembl protein sequence
+    """
+
+    if alignment.alignment_run.score1_type == 'identity':
+        cigarplus = alignment.pairwise.cigarplus
+        mdz = alignment.pairwise.mdz
+
+        if mdz.startswith('MD:Z:'):
+            mdz = mdz[len('MD:Z:'):]
+
+        uniprot_seq, match_str, ensembl_seq = pairwise_alignment(seq, cigarplus, mdz)
+
+        return EnspUPairwise(alignment_id=alignment.alignment_id, ensp_id=ensp, alignment_type='identity',
+                             uniprot_alignment=uniprot_seq, ensembl_alignment=ensembl_seq, match_str=match_str,
+                             time_rendered=timezone.now())
+
+    return EnspUPairwise(alignment_id=alignment.alignment_id, ensp_id=ensp, alignment_type='perfect_match',
+                         uniprot_alignment=seq, ensembl_alignment=seq, match_str='|' * len(seq),
+                         time_rendered=timezone.now())
+
+def fetch_pairwise_many(mappings):
+    """
+    Return the pairwise alignments of each of the given mappings, as fetch_pairwise.
+
+    The alignments are rendered once and stored (see EnspUPairwise), the
+    Ensembl proteins and their sequences needed to render the others are
+    fetched in batch, i.e. with one or two requests per Ensembl release
+    whatever the number of mappings.
+    """
+
+    used = [ (mapping, pairwise_alignments_used(mapping)) for mapping in mappings ]
+
+    rendered = rendered_pairwise([ alignment.alignment_id for _, alignments in used for alignment in alignments ])
+
+    transcripts_by_release = defaultdict(set)
+    for mapping, alignments in used:
+        for alignment in alignments:
+            if alignment.alignment_id not in rendered:
+                transcripts_by_release[alignment.alignment_run.ensembl_release].add(mapping.transcript.enst_id)
+
+    if transcripts_by_release:
+        # the releases are fetched concurrently
+        deadline = Deadline()
+        releases = list(transcripts_by_release)
+        futures = [ submit(deadline, fetch_release_sequences, transcripts_by_release[ens_release], ens_release) for ens_release in releases ]
+
+        proteins = {}
+        sequences = {}
+        for ens_release, (release_proteins, release_sequences) in zip(releases, gather(futures, deadline)):
+            proteins[ens_release] = release_proteins
+            sequences[ens_release] = release_sequences
+
+        newly_rendered = []
+        for mapping, alignments in used:
+            enst = mapping.transcript.enst_id
+
+            for alignment in alignments:
+                if alignment.alignment_id in rendered:
+                    continue
+
+                ens_release = alignment.alignment_run.ensembl_release
+                try:
+                    ensp = proteins[ens_release][enst]
+                    seq = sequences[ens_release][ensp]
+                except KeyError:
+                    raise Exception("Couldn't find the Ensembl protein sequence of {} in release {}".format(enst, ens_release))
+
+                rendered[alignment.alignment_id] = render_pairwise(alignment, ensp, seq)
+                newly_rendered.append(rendered[alignment.alignment_id])
+
+        store_rendered_pairwise(newly_rendered)
+
+    results = []
+    for mapping, alignments in used:
+        pairwise_alignments = []
+        for alignment in alignments:
+            pairwise = rendered[alignment.alignment_id]
+
+            pairwise_alignments.append({'uniprot_alignment': pairwise.uniprot_alignment,
+                                        'ensembl_alignment': pairwise.ensembl_alignment,
+                                        'match_str': pairwise.match_str,
                                         'alignment_id': alignment.alignment_id,
-                                        'ensembl_release': ens_release,
-                                        'ensembl_id': ensp,
-                                        'uniprot_id': uniprot_id,
-                                        'alignment_type': 'perfect_match'})
-            
-
-    return {'mapping_id': mapping.mapping_id,
-            'alignments': pairwise_alignments}
+                                        'ensembl_release': alignment.alignment_run.ensembl_release,
+                                        'ensembl_id': pairwise.ensp_id,
+                                        'uniprot_id': mapping.uniprot.uniprot_acc,
+                                        'alignment_type': pairwise.alignment_type})
+
+        results.append({'mapping_id': mapping.mapping_id,
+                        'alignments': pairwise_alignments})
+
+    return results
+
+def fetch_pairwise(mapping):
+    return fetch_pairwise_many([ mapping ])[0]
 
 def calculate_difference(cigar):
     diff_count = 0
@@ -0,0 +1,131 @@
+import re
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from sam_alignment_reconstructor.pairwise import cigar_split
+
+CIGAR_OPS = 'MIDNSHP=X'
+
+# a CIGAR string, and a batch of them each terminated by ';'
+CIGAR = re.compile(r"(?:[0-9]+[MIDNSHP=X])*")
+CIGARS = re.compile(r"(?:(?:[0-9]+[MIDNSHP=X])*;)*")
+
+CigarStats = namedtuple('CigarStats', ['differences', 'identity', 'coverage'])
+CigarStats.__doc__ = """
+Statistics of a batch of CIGAR strings, one value per string (NumPy arrays
+if NumPy is available, lists otherwise):
+
+differences: the number of inserted, deleted and mismatched residues (I, D, X),
+             as calculate_difference
+identity: the fraction of the alignment columns (M = X I D) which are matches (M =)
+coverage: the fraction of the query (M I S = X) which is aligned (M = X)
+"""
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+def _validate(cigars):
+    """
+    Raise a ValueError naming the first invalid CIGAR string of the given ones
+    (cigar_split doesn't reject them all, e.g. a trailing length)
+    """
+
+    for cigar in cigars:
+        if cigar != '*' and not CIGAR.fullmatch(cigar):
+            raise ValueError("Invalid CIGAR string {!r}".format(cigar))
+
+def _cigar_stats_python(cigars):
+    differences, identity, coverage = [], [], []
+
+    _validate(cigars)
+
+    for cigar in cigars:
+        totals = dict.fromkeys(CIGAR_OPS, 0)
+        for count, op in cigar_split(cigar):
+            if op is not None:
+                totals[op] += count
+
+        matches = totals['M'] + totals['=']
+        aligned = matches + totals['X']
+        differences.append(totals['I'] + totals['D'] + totals['X'])
+        identity.append(_ratio(matches, aligned + totals['I'] + totals['D']))
+        coverage.append(_ratio(aligned, aligned + totals['I'] + totals['S']))
+
+    return CigarStats(differences, identity, coverage)
+
+if np is not None:
+    # lookup table from the ASCII code of an operation to its index in CIGAR_OPS
+    OP_INDEX = np.zeros(256, dtype=np.int64)
+    for index, op in enumerate(CIGAR_OPS):
+        OP_INDEX[ord(op)] = index
+
+def _cigar_stats_numpy(cigars):
+    """
+    The CIGAR strings are joined and validated with a single regex pass, then
+    tokenised on the bytes: each digit contributes digit * 10^(its distance to
+    the following operation) to the length of that operation, and the totals
+    of each operation per string are a bincount over the (string, operation)
+    indexes weighted by the lengths
+    """
+
+    cigars = [ '' if cigar == '*' else cigar for cigar in cigars ]
+    joined = ';'.join(cigars) + ';'
+
+    # a ';' in one of the strings would pass for a separator
+    if joined.count(';') != len(cigars) or not CIGARS.fullmatch(joined):
+        _validate(cigars)
+
+    codes = np.frombuffer(joined.encode('ascii'), dtype=np.uint8)
+    digits = (codes >= ord('0')) & (codes <= ord('9'))
+
+    # operations and string separators, and the lengths of the operations
+    positions = np.flatnonzero(~digits)
+    digit_positions = np.flatnonzero(digits)
+    owner = np.searchsorted(positions, digit_positions)
+    contributions = (codes[digit_positions] - ord('0')) * 10 ** (positions[owner] - digit_positions - 1)
+    lengths = np.bincount(owner, weights=contributions, minlength=len(positions))
+
+    symbols = codes[positions]
+    separators = symbols == ord(';')
+    cigar_index = np.cumsum(separators)[~separators]
+    op_index = OP_INDEX[symbols[~separators]]
+
+    totals = np.bincount(cigar_index * len(CIGAR_OPS) + op_index, weights=lengths[~separators],
+                         minlength=len(cigars) * len(CIGAR_OPS)).astype(np.int64).reshape(len(cigars), len(CIGAR_OPS))
+    total = { op: totals[:, index] for index, op in enumerate(CIGAR_OPS) }
+
+    matches = total['M'] + total['=']
+    aligned = matches + total['X']
+    columns = aligned + total['I'] + total['D']
+    query = aligned + total['I'] + total['S']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        identity = np.where(columns > 0, matches / columns, 0.0)
+        coverage = np.where(query > 0, aligned / query, 0.0)
+
+    return CigarStats(total['I'] + total['D'] + total['X'], identity, coverage)
+
+def cigar_stats(cigars):
+    """
+    Return the CigarStats of the given CIGAR (cigarplus) strings,
+    vectorised with NumPy if available
+    """
+
+    cigars = list(cigars)
+    if np is None:
+        return _cigar_stats_python(cigars)
+
+    return _cigar_stats_numpy(cigars)
+
+def cigar_differences(cigars):
+    """
+    Return the list of the differences of the given CIGAR strings, as calculate_difference
+    """
+
+    differences = cigar_stats(cigars).differences
+
+    return differences.tolist() if np is not None else differences
@@ -0,0 +1,73 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from gifts_rest.http_client import http_client
+
+#
+# Bounded pool shared by the requests of the process to run their
+# independent remote calls concurrently
+#
+executor = ThreadPoolExecutor(max_workers=settings.REMOTE_CALLS_WORKERS)
+
+
+class Deadline(object):
+    """
+    Point in time by which the results a request waits for must be there
+    """
+
+    def __init__(self, seconds=None):
+        self.expires = time.monotonic() + (seconds if seconds is not None else settings.REMOTE_CALLS_DEADLINE)
+
+    def remaining(self):
+        return max(0, self.expires - time.monotonic())
+
+def _run(deadline, fn, args, kwargs):
+    # don't start calls the request has stopped waiting for
+    if not deadline.remaining():
+        raise TimeoutError()
+
+    # the worker threads have their own database connections, managed as
+    # for a request (i.e. according to CONN_MAX_AGE)
+    close_old_connections()
+    try:
+        with http_client.deadline(deadline):
+            return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+def submit(deadline, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) in the pool, return its future. The remote calls
+    it makes time out, and aren't retried, past the deadline, so that the
+    workers aren't kept busy by calls the request no longer waits for
+    """
+
+    return executor.submit(_run, deadline, fn, args, kwargs)
+
+def result(future, deadline):
+    """
+    Return the result of the future, raise TimeoutError if not there by the deadline
+    (the call, if started, keeps running until its remote calls time out)
+    """
+
+    try:
+        return future.result(timeout=deadline.remaining())
+    except TimeoutError:
+        future.cancel()
+        raise
+
+def gather(futures, deadline):
+    """
+    Return the results of the futures, in order, raise TimeoutError if they're
+    not all there by the deadline, cancelling the ones not started yet
+    """
+
+    try:
+        return [ result(future, deadline) for future in futures ]
+    except TimeoutError:
+        for future in futures:
+            future.cancel()
+        raise
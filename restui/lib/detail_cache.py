@@ -0,0 +1,104 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from restui.lib.cache import TTLCache
+from restui.models.mappings import MappingHistory
+
+logger = logging.getLogger(__name__)
+
+
+class MappingDetailCache(object):
+    """
+    Cache of the mapping detail documents (mapping/<id>/ endpoint), keyed by
+    mapping_id and whether the user is authenticated (the documents then
+    include the user names in the status history).
+
+    The documents are kept in an in-process LRU and, if a Redis URL is
+    configured, in Redis as well so that they're shared by all the processes.
+    The time to live of the in-process tier is short, as it bounds how long
+    a process can serve a document invalidated by a write in another one.
+    """
+
+    key_prefix = 'gifts:mapping_detail'
+
+    def __init__(self, maxsize, local_ttl, ttl, redis_url=None):
+        self.local = TTLCache(maxsize=maxsize, ttl=local_ttl)
+        self.ttl = ttl
+
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url)
+
+    def key(self, mapping_id, authenticated):
+        return '{}:{}:{}'.format(self.key_prefix, mapping_id, 1 if authenticated else 0)
+
+    def get(self, mapping_id, authenticated):
+        key = self.key(mapping_id, authenticated)
+
+        document = self.local.get(key)
+        if document is not None or self.redis is None:
+            return document
+
+        try:
+            cached = self.redis.get(key)
+        except Exception as e:
+            logger.warning("Cannot get the mapping detail document %s from Redis: %s", key, e)
+            return None
+
+        if cached is None:
+            return None
+
+        document = json.loads(cached.decode('utf-8'))
+        self.local.set(key, document)
+
+        return document
+
+    def set(self, mapping_id, authenticated, document):
+        key = self.key(mapping_id, authenticated)
+
+        self.local.set(key, document)
+
+        if self.redis is not None:
+            try:
+                self.redis.setex(key, self.ttl, json.dumps(document, cls=DjangoJSONEncoder))
+            except Exception as e:
+                logger.warning("Cannot store the mapping detail document %s in Redis: %s", key, e)
+
+    def delete(self, mapping_ids):
+        keys = [ self.key(mapping_id, authenticated) for mapping_id in mapping_ids for authenticated in (False, True) ]
+
+        for key in keys:
+            self.local.delete(key)
+
+        if self.redis is not None and keys:
+            try:
+                self.redis.delete(*keys)
+            except Exception as e:
+                logger.warning("Cannot delete the mapping detail documents %s from Redis: %s", ', '.join(keys), e)
+
+mapping_detail_cache = MappingDetailCache(maxsize=settings.MAPPING_DETAIL_CACHE_SIZE,
+                                          local_ttl=settings.MAPPING_DETAIL_CACHE_LOCAL_TTL,
+                                          ttl=settings.MAPPING_DETAIL_CACHE_TTL,
+                                          redis_url=settings.MAPPING_DETAIL_CACHE_REDIS_URL)
+
+def invalidate_mapping_detail(mapping):
+    """
+    Drop the cached detail documents of the given mapping and of the other
+    mappings in its group, which include it among their related entries
+    """
+
+    mapping_ids = set([ mapping.mapping_id ])
+
+    try:
+        mapping_mh = mapping.mapping_history.latest('release_mapping_history__time_mapped')
+    except MappingHistory.DoesNotExist:
+        pass
+    else:
+        mapping_ids.update(MappingHistory.objects.filter(release_mapping_history_id=mapping_mh.release_mapping_history_id,
+                                                         grouping_id=mapping_mh.grouping_id).values_list('mapping_id', flat=True))
+
+    mapping_detail_cache.delete(mapping_ids)
@@ -0,0 +1,258 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from psycopg2.extras import execute_values
+
+from django.db import connections, router, transaction
+
+from restui.lib.alignments import calculate_difference
+from restui.lib.cigar import cigar_differences
+from restui.models.ensembl import EnspUCigar
+from restui.models.mappings import Alignment, Mapping
+
+#
+# The alignments of the mappings, in mapping_id order (mappings without
+# alignments included), optionally restricted to the mappings of an
+# Ensembl release and/or after a given mapping_id
+#
+ALIGNMENTS_SQL = """
+SELECT m.mapping_id, ar.score1_type, a.score1, c.cigarplus, a.is_current
+  FROM mapping m
+  LEFT JOIN alignment a ON a.mapping_id = m.mapping_id
+  LEFT JOIN alignment_run ar ON ar.alignment_run_id = a.alignment_run_id
+  LEFT JOIN ensp_u_cigar c ON c.alignment_id = a.alignment_id
+ WHERE m.mapping_id > %s {}
+ ORDER BY m.mapping_id, a.alignment_id
+"""
+
+RELEASE_FILTER_SQL = """
+   AND EXISTS (SELECT 1
+                 FROM mapping_history mh
+                 JOIN release_mapping_history rmh ON rmh.release_mapping_history_id = mh.release_mapping_history_id
+                 JOIN ensembl_species_history esh ON esh.ensembl_species_history_id = rmh.ensembl_species_history_id
+                WHERE mh.mapping_id = m.mapping_id AND esh.ensembl_release = %s)
+"""
+
+COUNT_SQL = "SELECT count(*) FROM mapping m WHERE m.mapping_id > %s {}"
+
+UPDATE_SQL = """
+UPDATE {} t
+   SET alignment_difference = v.alignment_difference
+  FROM (VALUES %s) AS v (mapping_id, alignment_difference)
+ WHERE t.mapping_id = v.mapping_id
+   AND t.alignment_difference IS DISTINCT FROM v.alignment_difference
+"""
+
+def current_alignments(alignments):
+    """
+    Return the alignments a mapping difference is computed from, i.e. the
+    current ones (is_current) if the mapping has any, all of them otherwise
+    """
+
+    current = [ alignment for alignment in alignments if alignment[3] ]
+
+    return current if current else alignments
+
+def mapping_difference(alignments, differences=None):
+    """
+    Return the alignment difference of a mapping, from the (score1_type,
+    score1, cigarplus, is_current) of its alignments in alignment_id order:
+    0 if one of the current alignments is a perfect match, the difference
+    of the last current identity alignment otherwise (None if no difference)
+
+    differences: the differences of the cigarplus strings if already computed
+    """
+
+    diff_count = None
+
+    for score1_type, score1, cigarplus, _ in current_alignments(alignments):
+        if score1_type == 'perfect_match' and score1 == 1:
+            return 0
+
+        elif score1_type == 'identity' and cigarplus is not None:
+            diff_count = differences[cigarplus] if differences is not None else calculate_difference(cigarplus)
+
+    if diff_count:
+        return diff_count
+
+    return None
+
+def _filters(after, release):
+    sql, params = '', [ after ]
+    if release is not None:
+        sql = RELEASE_FILTER_SQL
+        params.append(release)
+
+    return sql, params
+
+def count_mappings(after=0, release=None):
+    sql, params = _filters(after, release)
+
+    with connections[router.db_for_read(Mapping)].cursor() as cursor:
+        cursor.execute(COUNT_SQL.format(sql), params)
+        return cursor.fetchone()[0]
+
+def group_mapping_alignments(rows, chunk_size):
+    """
+    Yield chunks of chunk_size (mapping_id, alignments) pairs from the
+    (mapping_id, score1_type, score1, cigarplus, is_current) rows of ALIGNMENTS_SQL,
+    where alignments is the list of the (score1_type, score1, cigarplus, is_current)
+    of the mapping
+    """
+
+    chunk = []
+    current_id, current = None, None
+
+    for mapping_id, score1_type, score1, cigarplus, is_current in rows:
+        if mapping_id != current_id:
+            if current_id is not None:
+                chunk.append((current_id, current))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+
+            current_id, current = mapping_id, []
+
+        # mappings without alignments come with a single row of nulls
+        if score1_type is not None:
+            current.append((score1_type, score1, cigarplus, is_current))
+
+    if current_id is not None:
+        chunk.append((current_id, current))
+    if chunk:
+        yield chunk
+
+def _fetch_rows(cursor, fetch_size):
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+
+        yield from rows
+
+def stream_mapping_alignments(chunk_size, after=0, release=None, fetch_size=10000):
+    """
+    Yield chunks of chunk_size (mapping_id, alignments) pairs as
+    group_mapping_alignments does, read with a single server-side cursor
+    """
+
+    sql, params = _filters(after, release)
+
+    with connections[router.db_for_read(Mapping)].chunked_cursor() as cursor:
+        cursor.execute(ALIGNMENTS_SQL.format(sql), params)
+
+        yield from group_mapping_alignments(_fetch_rows(cursor, fetch_size), chunk_size)
+
+def write_differences(differences):
+    """
+    Set the alignment_difference of the given (mapping_id, difference) in
+    mapping and mapping_view, in one transaction, return the number of
+    mapping records changed
+    """
+
+    using = router.db_for_write(Mapping)
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        execute_values(cursor.cursor, UPDATE_SQL.format('mapping'), differences, template='(%s::bigint, %s::integer)', page_size=len(differences))
+        updated = cursor.cursor.rowcount
+
+        execute_values(cursor.cursor, UPDATE_SQL.format('mapping_view'), differences, template='(%s::bigint, %s::integer)', page_size=len(differences))
+
+    return updated
+
+def identity_differences(mappings_alignments):
+    """
+    Return a dict of the differences of the cigarplus strings of the current
+    identity alignments of the given mappings' alignments, computed in one go
+    """
+
+    cigars = list(set( cigarplus for alignments in mappings_alignments for score1_type, _, cigarplus, _ in current_alignments(alignments)
+                       if score1_type == 'identity' and cigarplus is not None ))
+
+    return dict(zip(cigars, cigar_differences(cigars)))
+
+def fill_chunk(chunk):
+    """
+    Compute and write the alignment differences of a chunk of mappings as
+    yielded by stream_mapping_alignments, return the last mapping_id of the
+    chunk, its number of mappings and of those changed
+    """
+
+    cigar_diffs = identity_differences( alignments for _, alignments in chunk )
+
+    differences = [ (mapping_id, mapping_difference(alignments, cigar_diffs)) for mapping_id, alignments in chunk ]
+
+    return chunk[-1][0], len(chunk), write_differences(differences)
+
+
+class DifferenceResolver(object):
+    """
+    Compute the alignment differences of mappings in bulk, with a single query
+    fetching their alignments with their run and cigar, and the differences of
+    all their cigars in one go.
+
+    The differences are cached for the lifetime of the resolver, so use one per
+    request or unit of work, e.g. with differences_scope.
+    """
+
+    def __init__(self):
+        self._differences = {}
+
+    def differences(self, mapping_ids):
+        """
+        Return a dict of the alignment differences of the given mappings
+        """
+
+        missing = set( mapping_id for mapping_id in mapping_ids if mapping_id not in self._differences )
+        if missing:
+            alignments = defaultdict(list)
+            for alignment in Alignment.objects.filter(mapping_id__in=missing).select_related('alignment_run', 'pairwise').order_by('alignment_id'):
+                alignments[alignment.mapping_id].append((alignment.alignment_run.score1_type, alignment.score1, _cigarplus(alignment), alignment.is_current))
+
+            cigar_diffs = identity_differences(alignments.values())
+
+            for mapping_id in missing:
+                self._differences[mapping_id] = mapping_difference(alignments[mapping_id], cigar_diffs)
+
+        return { mapping_id: self._differences[mapping_id] for mapping_id in mapping_ids }
+
+    def difference(self, mapping_id):
+        return self.differences([ mapping_id ])[mapping_id]
+
+def _cigarplus(alignment):
+    try:
+        return alignment.pairwise.cigarplus
+    except EnspUCigar.DoesNotExist:
+        return None
+
+_scope = threading.local()
+
+@contextmanager
+def differences_scope():
+    """
+    Share a DifferenceResolver between the Mapping/MappingView.difference
+    lookups of the current thread within the block, nested blocks share the
+    outermost one. Yield the resolver, e.g. to resolve a page of mappings at once.
+    """
+
+    outer = getattr(_scope, 'resolver', None)
+    if outer is not None:
+        yield outer
+        return
+
+    _scope.resolver = DifferenceResolver()
+    try:
+        yield _scope.resolver
+    finally:
+        _scope.resolver = None
+
+def scoped_resolver():
+    """
+    Return the resolver of the enclosing differences_scope, outside of any a
+    new one, i.e. nothing is cached beyond the lookup
+    """
+
+    resolver = getattr(_scope, 'resolver', None)
+
+    return resolver if resolver is not None else DifferenceResolver()
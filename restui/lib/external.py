@@ -1,12 +1,29 @@
+import logging
+import sqlite3
+
 from django.http import Http404
-import requests
 
-from gifts_rest.settings.base import TARK_SERVER, ENSEMBL_REST_SERVER
+from gifts_rest.settings.base import TARK_SERVER, ENSEMBL_REST_SERVER, ENSEMBL_RELEASE_TTL, ENSEMBL_LOOKUP_CACHE_SIZE, ENSEMBL_SEQUENCE_CACHE_SIZE,\
+    ENSEMBL_LOOKUP_BATCH_SIZE, ENSEMBL_SEQUENCE_BATCH_SIZE
+from gifts_rest.http_client import http_client
+from restui.lib.cache import TTLCache
+from restui.lib.sequence_store import sequence_store
+
+logger = logging.getLogger(__name__)
+
+#
+# The current release changes a few times a year, it's resolved again
+# once expired. Translations and sequences of a given release never change,
+# so they're only evicted when the caches are full.
+#
+release_cache = TTLCache(maxsize=1, ttl=ENSEMBL_RELEASE_TTL)
+protein_cache = TTLCache(maxsize=ENSEMBL_LOOKUP_CACHE_SIZE)
+sequence_cache = TTLCache(maxsize=ENSEMBL_SEQUENCE_CACHE_SIZE)
 
 def tark_transcript(enst_id, release):
     url = "{}/api/transcript/?stable_id={}&release_short_name={}&expand=sequence"
 
-    r = requests.get(url.format(TARK_SERVER, enst_id, release))
+    r = http_client.get(url.format(TARK_SERVER, enst_id, release))
     if not r.ok:
         raise Http404
 
@@ -24,31 +41,162 @@ def ensembl_current_release():
     """
     Return current Ensembl release number.
     """
-    
-    r = requests.get("{}/info/software".format(ENSEMBL_REST_SERVER), headers={ "Content-Type" : "application/json"})
+
+    release = release_cache.get('release')
+    if release is not None:
+        return release
+
+    r = http_client.get("{}/info/software".format(ENSEMBL_REST_SERVER), headers={ "Content-Type" : "application/json"})
     if not r.ok:
         r.raise_for_status()
 
-    return r.json()['release']
+    release = r.json()['release']
+    release_cache.set('release', release)
+
+    return release
+
+def ensembl_server(release):
+    """
+    Return the REST server for the given Ensembl release
+    """
+
+    return ENSEMBL_REST_SERVER if release == ensembl_current_release() else "http://e{}.rest.ensembl.org".format(release)
+
+def stored_sequence(stable_id, release):
+    """
+    Return the sequence from the local sequence store, None if not there
+    """
+
+    if sequence_store is None or release is None:
+        return None
+
+    try:
+        return sequence_store.get(stable_id, release)
+    except sqlite3.Error as e:
+        logger.warning("Cannot read %s (release %s) from the sequence store: %s", stable_id, release, e)
+        return None
 
 def ensembl_sequence(enst_id, release):
-    e_current_release = ensembl_current_release()
-    server = ENSEMBL_REST_SERVER if release == e_current_release else "http://e{}.rest.ensembl.org".format(release)
+    sequence = sequence_cache.get((enst_id, release))
+    if sequence is not None:
+        return sequence
 
-    r = requests.get("{}/sequence/id/{}?content-type=text/plain".format(server, enst_id))
-    if not r.ok:
-        r.raise_for_status()
+    sequence = stored_sequence(enst_id, release)
+    if sequence is None:
+        r = http_client.get("{}/sequence/id/{}?content-type=text/plain".format(ensembl_server(release), enst_id))
+        if not r.ok:
+            r.raise_for_status()
+
+        sequence = r.text
+
+    sequence_cache.set((enst_id, release), sequence)
 
-    return r.text
+    return sequence
 
 def ensembl_protein(enst_id, release):
-    e_current_release = ensembl_current_release()
-    server = ENSEMBL_REST_SERVER if release == e_current_release else "http://e{}.rest.ensembl.org".format(release)
+    ensp_id = protein_cache.get((enst_id, release))
+    if ensp_id is not None:
+        return ensp_id
 
-    r = requests.get("{}/lookup/id/{}?expand=1&content-type=application/json".format(server, enst_id))
+    r = http_client.get("{}/lookup/id/{}?expand=1&content-type=application/json".format(ensembl_server(release), enst_id))
     if not r.ok:
         r.raise_for_status()
 
     ensembl_json = r.json()
+    ensp_id = ensembl_json['Translation']['id']
+    protein_cache.set((enst_id, release), ensp_id)
+
+    return ensp_id
+
+def chunks(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start+size]
+
+def ensembl_proteins(enst_ids, release):
+    """
+    Return a dict of the ENSP IDs of the translations of the given transcripts
+    in the given release, transcripts without translation are left out.
+
+    The transcripts not already cached are looked up with the Ensembl REST
+    POST /lookup/id endpoint, ENSEMBL_LOOKUP_BATCH_SIZE at a time.
+    """
+
+    ensp_ids = {}
+    missing = []
+    for enst_id in set(enst_ids):
+        ensp_id = protein_cache.get((enst_id, release))
+        if ensp_id is not None:
+            ensp_ids[enst_id] = ensp_id
+        else:
+            missing.append(enst_id)
+
+    if not missing:
+        return ensp_ids
+
+    server = ensembl_server(release)
+    for chunk in chunks(sorted(missing), ENSEMBL_LOOKUP_BATCH_SIZE):
+        r = http_client.post("{}/lookup/id?expand=1".format(server),
+                             json={ "ids": chunk },
+                             headers={ "Content-Type": "application/json", "Accept": "application/json" })
+        if not r.ok:
+            r.raise_for_status()
+
+        for enst_id, ensembl_json in r.json().items():
+            if not ensembl_json or not ensembl_json.get('Translation'):
+                continue
+
+            ensp_id = ensembl_json['Translation']['id']
+            protein_cache.set((enst_id, release), ensp_id)
+            ensp_ids[enst_id] = ensp_id
+
+    return ensp_ids
+
+def ensembl_sequences(stable_ids, release):
+    """
+    Return a dict of the sequences of the given stable IDs in the given release.
+
+    The sequences neither cached nor in the local sequence store are fetched
+    with the Ensembl REST POST /sequence/id endpoint, ENSEMBL_SEQUENCE_BATCH_SIZE
+    at a time (the store is only written by the populate_sequence_store command).
+    """
+
+    sequences = {}
+    missing = []
+    for stable_id in set(stable_ids):
+        sequence = sequence_cache.get((stable_id, release))
+        if sequence is not None:
+            sequences[stable_id] = sequence
+        else:
+            missing.append(stable_id)
+
+    if missing and sequence_store is not None and release is not None:
+        try:
+            stored = sequence_store.get_many(missing, release)
+        except sqlite3.Error as e:
+            logger.warning("Cannot read %d sequences (release %s) from the sequence store: %s", len(missing), release, e)
+        else:
+            for stable_id, sequence in stored.items():
+                sequence_cache.set((stable_id, release), sequence)
+            sequences.update(stored)
+            missing = [ stable_id for stable_id in missing if stable_id not in stored ]
+
+    if not missing:
+        return sequences
+
+    server = ensembl_server(release)
+    for chunk in chunks(sorted(missing), ENSEMBL_SEQUENCE_BATCH_SIZE):
+        r = http_client.post("{}/sequence/id".format(server),
+                             json={ "ids": chunk },
+                             headers={ "Content-Type": "application/json", "Accept": "application/json" })
+        if not r.ok:
+            r.raise_for_status()
+
+        fetched = {}
+        for sequence_json in r.json():
+            stable_id = sequence_json.get('query', sequence_json['id'])
+            fetched[stable_id] = sequence_json['seq']
+            sequence_cache.set((stable_id, release), sequence_json['seq'])
+
+        sequences.update(fetched)
 
-    return ensembl_json['Translation']['id']
+    return sequences
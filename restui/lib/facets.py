@@ -0,0 +1,158 @@
+import logging
+import threading
+
+from django.db import connections, router
+
+from restui.lib.search import filter_facets, invalidate_search_cache
+from restui.lib.taxonomy import taxonomy_registry
+from restui.models.mappings import MappingViewFacets
+
+logger = logging.getLogger(__name__)
+
+#
+# Compute all the facets of a mapping_view search in one aggregate pass
+# over the filtered set: one grouping set for each facet whose buckets are the
+# distinct values of a column, plus the empty grouping set for the whole set
+# where the divergence counts and the patches flag are computed with
+# conditional aggregates. The entries are counted one per row of
+# mapping_view, or by the total of each row of mapping_view_facets
+#
+FACETS_SQL = """
+SELECT uniprot_tax_id, status, uniprot_mapping_status, chromosome,
+       GROUPING(uniprot_tax_id), GROUPING(status), GROUPING(uniprot_mapping_status), GROUPING(chromosome),
+       {count} FILTER (WHERE alignment_difference = 0),
+       {count} FILTER (WHERE alignment_difference > 0 AND alignment_difference <= 5),
+       {count} FILTER (WHERE alignment_difference > 5),
+       COALESCE(BOOL_OR(region_accession ~* '^CHR'), FALSE)
+FROM ({filtered}) AS filtered
+GROUP BY GROUPING SETS ((uniprot_tax_id), (status), (uniprot_mapping_status), (chromosome), ())
+"""
+
+FACETS_COLUMNS = ('uniprot_tax_id', 'status', 'uniprot_mapping_status', 'chromosome', 'alignment_difference', 'region_accession')
+
+def compute_facets(queryset, totals=False):
+    """
+    Return the facets of a MappingView queryset, i.e. a dict with:
+    - species: list of (tax_id, species name) tuples
+    - statuses: list of status ids
+    - divergences: [ identical, small, large ] alignment difference counts
+    - types: list of mapping types
+    - chromosomes: sorted list of chromosomes
+    - patches: whether the queryset has entries defined on patches
+
+    Equivalent to calling the queryset species, statuses, divergences, types,
+    chromosomes and has_patches methods, but with a single query.
+
+    totals: the queryset rows stand for the number of entries in their total
+            column, as those of MappingViewFacets
+    """
+
+    columns, count = (FACETS_COLUMNS + ('total',), 'SUM(total)') if totals else (FACETS_COLUMNS, 'COUNT(*)')
+    sql, params = queryset.values(*columns).order_by().query.sql_with_params()
+
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(FACETS_SQL.format(count=count, filtered=sql), params)
+        rows = cursor.fetchall()
+
+    tax_ids, statuses, types, chromosomes = set(), set(), set(), set()
+    divergences, patches = [ 0, 0, 0 ], False
+
+    for row in rows:
+        tax_id, status, mapping_type, chromosome = row[0:4]
+        by_tax_id, by_status, by_type, by_chromosome = ( not grouping for grouping in row[4:8] )
+
+        if by_tax_id:
+            if tax_id is not None:
+                tax_ids.add(tax_id)
+        elif by_status:
+            if status is not None:
+                statuses.add(status)
+        elif by_type:
+            if mapping_type:
+                types.add(mapping_type)
+        elif by_chromosome:
+            if chromosome:
+                chromosomes.add(chromosome)
+        else:
+            # the empty grouping set, i.e. the whole filtered set
+            divergences = [ int(count or 0) for count in row[8:11] ]
+            patches = row[11]
+
+    species = [ (tax_id, taxonomy_registry.species(tax_id)) for tax_id in sorted(tax_ids) ]
+
+    return { 'species': species,
+             'statuses': sorted(statuses),
+             'divergences': divergences,
+             'types': sorted(types),
+             'chromosomes': sorted(chromosomes),
+             'patches': patches }
+
+def summary_facets(facets_params):
+    """
+    Return the facets of a mapping search with no search term as compute_facets
+    does, filtered by the given facets parameter, from the mapping_view_facets
+    summary (see schema/0008.sql) rather than from the whole of mapping_view,
+    i.e. as of the last time the summary was refreshed
+    """
+
+    return compute_facets(filter_facets(MappingViewFacets.objects.all(), facets_params), totals=True)
+
+def refresh_summary_facets():
+    """
+    Recompute the mapping_view_facets summary from mapping_view, without
+    blocking the reads of the previous summary meanwhile
+    """
+
+    with connections[router.db_for_write(MappingViewFacets)].cursor() as cursor:
+        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mapping_view_facets")
+
+    # the facets cached in the meantime came from the previous summary
+    invalidate_search_cache()
+
+
+class SummaryRefresh(object):
+    """
+    Refresh the mapping_view_facets summary in the background after the
+    status of mapping_view entries has been updated, so that the facets of
+    a browse with no search term are only stale for the time of a refresh.
+
+    Updates made while a refresh is running are picked by a single following
+    one, i.e. a burst of updates doesn't queue a refresh each.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self._pending = False
+
+    def _refresh(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        self._running = False
+                        return
+                    self._pending = False
+
+                try:
+                    refresh_summary_facets()
+                except Exception:
+                    logger.warning("Cannot refresh the mapping_view_facets summary", exc_info=True)
+        finally:
+            # the thread has its own database connections
+            connections.close_all()
+
+    def schedule(self):
+        """
+        Refresh the summary in the background, once the running refresh (if any) is done
+        """
+
+        with self._lock:
+            self._pending = True
+            if self._running:
+                return
+            self._running = True
+
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+summary_refresh = SummaryRefresh()
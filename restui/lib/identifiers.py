@@ -0,0 +1,50 @@
+from restui.lib.external import ensembl_proteins
+from restui.models.ensembl import TranscriptHistory
+
+
+def loaded_proteins(enst_ids, release):
+    """
+    Return a dict of the ENSP IDs (None if no translation) of the given
+    transcripts, for those loaded from the given Ensembl release.
+
+    The ENSP ID is the one of the transcript record, i.e. of the latest
+    release the transcript has been loaded from, translation stable IDs
+    don't change across the releases of a transcript.
+    """
+
+    if not enst_ids or release is None:
+        return {}
+
+    return dict(TranscriptHistory.objects.filter(transcript__enst_id__in=enst_ids,
+                                                 ensembl_species_history__ensembl_release=release)
+                                         .values_list('transcript__enst_id', 'transcript__ensp_id')
+                                         .distinct())
+
+def loaded_transcripts(release):
+    """
+    Return the stable IDs of the transcripts loaded from the given Ensembl release
+    """
+
+    return list(TranscriptHistory.objects.filter(ensembl_species_history__ensembl_release=release)
+                                         .values_list('transcript__enst_id', flat=True)
+                                         .distinct())
+
+def resolve_proteins(enst_ids, release):
+    """
+    Return a dict of the ENSP IDs of the translations of the given transcripts
+    in the given release, transcripts without translation are left out.
+
+    The transcripts loaded from the release are resolved from the database,
+    the others with the Ensembl REST lookup endpoint (see ensembl_proteins).
+    """
+
+    enst_ids = set(enst_ids)
+
+    loaded = loaded_proteins(enst_ids, release)
+    proteins = { enst_id: ensp_id for enst_id, ensp_id in loaded.items() if ensp_id }
+
+    missing = enst_ids.difference(loaded)
+    if missing:
+        proteins.update(ensembl_proteins(missing, release))
+
+    return proteins
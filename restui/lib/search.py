@@ -0,0 +1,257 @@
+import re
+import urllib.parse
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import CharField, F, Func, Q, Value
+from django.db.models.functions import Upper
+from django.http import Http404
+
+from restui.lib.cache import TTLCache
+from restui.models.annotations import CvUeStatus
+from restui.models.mappings import MappingView
+
+#
+# Cache of the expensive parts of a mapping search which don't depend on the
+# requested page, i.e. the grouping_id counts and the facets, so that paging
+# through a result set only pays for them once.
+#
+# The cache is per process, its entries are keyed by the search cache version
+# shared by all the processes (see schema/0010.sql): writes which change the
+# status of mapping_view entries bump it, so that no process serves the counts
+# and facets cached before the write.
+#
+SEARCH_CACHE_VERSION_SQL = "SELECT last_value FROM search_cache_version_seq"
+BUMP_SEARCH_CACHE_VERSION_SQL = "SELECT nextval('search_cache_version_seq')"
+
+search_cache = TTLCache(maxsize=settings.SEARCH_CACHE_SIZE, ttl=settings.SEARCH_CACHE_TTL)
+
+#
+# Patterns of the identifiers which can be searched for (case insensitive)
+#
+ENSG_PATTERN = re.compile(r"^ENS[A-Z]*?G[0-9]+?$", re.I)
+ENST_PATTERN = re.compile(r"^ENS[A-Z]*?T[0-9]+?$", re.I)
+UNIPROT_PATTERN = re.compile(r"^([O,P,Q][0-9][A-Z, 0-9]{3}[0-9]|[A-N,R-Z]([0-9][A-Z][A-Z, 0-9]{2}){1,2}[0-9])(-\d+)*$", re.I)
+
+# max number of identifiers in each of the bulk lookup queries
+LOOKUP_CHUNK_SIZE = 1000
+
+def classify_identifier(identifier):
+    """
+    Return the type of the given identifier, i.e. 'ensg', 'enst' or 'uniprot'
+    (accession, possibly of an isoform), None if not recognised
+    """
+
+    if ENSG_PATTERN.match(identifier):
+        return 'ensg'
+    elif ENST_PATTERN.match(identifier):
+        return 'enst'
+    elif UNIPROT_PATTERN.match(identifier):
+        return 'uniprot'
+
+    return None
+
+def search_signature(search_term, facets_params):
+    """
+    Normalise the search term and the facets parameters of a mapping search
+    into a hashable signature, so that equivalent searches, e.g. with a different
+    case or a different order of facets and values, share the same cache entries.
+    The signature includes the current search cache version.
+    """
+
+    # search term lookups are all case insensitive
+    term = search_term.lower() if search_term else None
+
+    facets = ()
+    if facets_params:
+        facets_dict = parse_facets(facets_params)
+        facets = tuple(sorted( (name, tuple(sorted(set(values.split(','))))) for name, values in facets_dict.items() ))
+
+    return (search_cache_version(), term, facets)
+
+def search_cache_version():
+    with connections[router.db_for_read(MappingView)].cursor() as cursor:
+        cursor.execute(SEARCH_CACHE_VERSION_SQL)
+
+        return cursor.fetchone()[0]
+
+def invalidate_search_cache():
+    """
+    Drop all the cached searches, to be called whenever mapping_view is updated
+    """
+
+    # the entries of the other processes are keyed by the previous version
+    with connections[router.db_for_write(MappingView)].cursor() as cursor:
+        cursor.execute(BUMP_SEARCH_CACHE_VERSION_SQL)
+
+    search_cache.clear()
+
+def prefix_filter(search_term, *fields):
+    """
+    Case insensitive prefix match of the search term on any of the given fields.
+
+    Unlike an anchored iregex, istartswith translates to UPPER(field) LIKE 'TERM%'
+    which Postgres can answer with the upper(field) text_pattern_ops indexes
+    (see schema/0005.sql). The term is matched literally, i.e. not as a regex.
+    """
+
+    return reduce(or_, ( Q(**{ '{}__istartswith'.format(field): search_term }) for field in fields ))
+
+def parse_facets(facets_params):
+    """
+    Create the facets dict from the facets parameter of a mapping search,
+    e.g. 'organism:9606,10090;status:unreviewed;chromosome:10,11,X'
+    """
+
+    # NOTE: must unquote as apparently the browser does not decode
+    facets_params = urllib.parse.unquote(facets_params)
+
+    return dict( tuple(param.split(':')) for param in facets_params.split(';') )
+
+def search_mapping_views(search_term, facets_params):
+    """
+    Return the MappingView queryset matching a mapping search, i.e. the
+    given search term (ENSG, ENST, UniProt accession, gene symbol or gene name,
+    all mappings if not provided) filtered by the given facets parameter
+    """
+
+    # search the mappings according to the search term 'type'
+    queryset = None
+    if search_term:
+        identifier_type = classify_identifier(search_term)
+
+        if identifier_type == 'ensg':
+            queryset = MappingView.objects.filter(ensg_id__iexact=search_term)
+        elif identifier_type == 'enst':
+            queryset = MappingView.objects.filter(enst_id__iexact=search_term)
+        elif identifier_type == 'uniprot': # looks like a Uniprot accession
+            # filter in order to get the isoforms as well
+            queryset = MappingView.objects.filter(prefix_filter(search_term, 'uniprot_acc'))
+        else:
+            # should be a search request with a gene symbol (both Uniprot and Ensembl) and possibly name
+            queryset = MappingView.objects.filter(prefix_filter(search_term, 'gene_symbol_up', 'gene_symbol_eg', 'gene_name'))
+    else:
+        # no search term: return all mappings
+        queryset = MappingView.objects.all()
+
+    return filter_facets(queryset, facets_params)
+
+def filter_facets(queryset, facets_params):
+    """
+    Apply the filters of the given facets parameter of a mapping search to a
+    MappingView (or MappingViewFacets) queryset
+    """
+
+    if facets_params:
+        facets = parse_facets(facets_params)
+
+        queryset = queryset.all()
+
+        # filter based on species
+        if 'organism' in facets:
+            # consider query may request for multiple organisms
+            queryset = queryset.filter(uniprot_tax_id__in=facets['organism'].split(','))
+
+        # filter on how large a difference between the pairwise
+        # aligned protein sequences is, if there is an alignment
+        if 'alignment' in facets:
+            # consider query may request for multiple alignment differences
+            alignment_diff_filter = Q()
+
+            for diff in facets['alignment'].split(','):
+                if diff == 'identical':
+                    alignment_diff_filter |= Q(alignment_difference=0)
+                elif diff == 'small':
+                    alignment_diff_filter |= Q(alignment_difference__gt=0, alignment_difference__lte=5)
+                elif diff == 'large':
+                    alignment_diff_filter |= Q(alignment_difference__gt=5)
+
+            queryset = queryset.filter(alignment_diff_filter)
+
+        # filter based on status
+        if 'status' in facets:
+            # possible multiple statuses
+            status_filter = Q()
+
+            for status_description in facets['status'].split(','):
+                try:
+                    status_id = CvUeStatus.objects.get(description=status_description.upper()).id
+                except:
+                    # TODO Should be a 400, how do we make this work with pagination?
+                    # return Response(status=status.HTTP_400_BAD_REQUEST)
+                    raise Http404("Invalid status type")
+                else:
+                    status_filter |= Q(status=status_id)
+
+            queryset = queryset.filter(status_filter)
+
+        # filter based on chromosomes
+        if 'chromosomes' in facets:
+            # possible multiple chromosomes
+            queryset = queryset.filter(chromosome__in=facets['chromosomes'].split(','))
+
+        # filter based on entry type
+        if 'type' in facets:
+            # possible multiple types
+            queryset = queryset.filter(uniprot_mapping_status__in=facets['type'].split(','))
+
+        # filter out entries on patches
+        if 'patches' in facets:
+            # options, should be mutually exclusive
+            # - 1: include patches
+            # - 2: exclude patches
+            # - 3: include only patches
+            if facets["patches"] == 'exclude':
+                queryset = queryset.exclude(region_accession__iregex=r"^CHR")
+            elif facets["patches"] == 'only':
+                queryset = queryset.filter(region_accession__iregex=r"^CHR")
+
+    return queryset
+
+def lookup_mapping_views(identifiers):
+    """
+    Find the mapping views of each of the given ENSG/ENST IDs and UniProt
+    accessions (a canonical accession also matches its isoforms), with one
+    query per type of identifier and chunk of LOOKUP_CHUNK_SIZE identifiers.
+
+    Return a tuple with a dict identifier -> list of MappingView, for all the
+    recognised identifiers, and the list of the unrecognised ones
+    """
+
+    # upper case identifier -> given identifiers, for each type
+    wanted = { 'ensg':{}, 'enst':{}, 'uniprot':{} }
+    unrecognised = []
+
+    for identifier in identifiers:
+        identifier_type = classify_identifier(identifier)
+        if identifier_type is None:
+            unrecognised.append(identifier)
+        else:
+            wanted[identifier_type].setdefault(identifier.upper(), []).append(identifier)
+
+    results = { identifier: [] for identifiers_by_key in wanted.values() for keys in identifiers_by_key.values() for identifier in keys }
+
+    def collect(identifier_type, queryset, keys_of):
+        keys = list(wanted[identifier_type])
+        for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            for mapping_view in queryset(keys[start:start+LOOKUP_CHUNK_SIZE]).order_by('-grouping_id', 'id'):
+                for key in keys_of(mapping_view):
+                    for identifier in wanted[identifier_type].get(key, ()):
+                        results[identifier].append(mapping_view)
+
+    collect('ensg',
+            lambda keys: MappingView.objects.annotate(ensg_id_upper=Upper('ensg_id')).filter(ensg_id_upper__in=keys),
+            lambda mapping_view: ( mapping_view.ensg_id_upper, ))
+    collect('enst',
+            lambda keys: MappingView.objects.annotate(enst_id_upper=Upper('enst_id')).filter(enst_id_upper__in=keys),
+            lambda mapping_view: ( mapping_view.enst_id_upper, ))
+    # an accession matches itself and, if canonical, its isoforms
+    collect('uniprot',
+            lambda keys: MappingView.objects.annotate(uniprot_acc_upper=Upper('uniprot_acc'),
+                                                      uniprot_base_acc_upper=Upper(Func(F('uniprot_acc'), Value('-'), Value(1), function='split_part', output_field=CharField())))
+                                            .filter(Q(uniprot_acc_upper__in=keys) | Q(uniprot_base_acc_upper__in=keys)),
+            lambda mapping_view: set(( mapping_view.uniprot_acc_upper, mapping_view.uniprot_base_acc_upper )))
+
+    return results, unrecognised
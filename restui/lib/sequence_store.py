@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sequence (
+    checksum TEXT PRIMARY KEY,
+    sequence TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stable_id (
+    stable_id TEXT NOT NULL,
+    release INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (stable_id, release)
+);
+"""
+
+def sequence_checksum(sequence):
+    """
+    Return the MD5 checksum of the given sequence, computed as the
+    UniProt/UniParc ones (uniprot_entry.md5)
+    """
+
+    return hashlib.md5(sequence.upper().encode('ascii')).hexdigest()
+
+
+class SequenceStore(object):
+    """
+    Local on-disk (SQLite) store of the Ensembl sequences.
+
+    Sequences are stored once, keyed by their checksum, and are looked up
+    by (stable ID, Ensembl release). The store is only written in bulk by the
+    populate_sequence_store command, the requests read it before falling back
+    to Ensembl REST (see restui.lib.external).
+
+    Each thread has its own connection, the database is in WAL mode so the
+    readers of the server processes aren't blocked while it's written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+
+        return connection
+
+    def get(self, stable_id, release):
+        """
+        Return the sequence of the given stable ID in the given release, None if not stored
+        """
+
+        row = self._connection().execute('SELECT s.sequence FROM stable_id i JOIN sequence s ON s.checksum = i.checksum '
+                                         'WHERE i.stable_id = ? AND i.release = ?', (stable_id, int(release))).fetchone()
+
+        return row[0] if row else None
+
+    def get_many(self, stable_ids, release):
+        """
+        Return a dict of the stored sequences of the given stable IDs in the given release
+        """
+
+        stable_ids = list(stable_ids)
+        sequences = {}
+
+        # keep under the SQLite limit on the number of query parameters
+        for start in range(0, len(stable_ids), 500):
+            chunk = stable_ids[start:start+500]
+            rows = self._connection().execute('SELECT i.stable_id, s.sequence FROM stable_id i JOIN sequence s ON s.checksum = i.checksum '
+                                              'WHERE i.release = ? AND i.stable_id IN ({})'.format(','.join('?' * len(chunk))),
+                                              [ int(release) ] + chunk)
+            sequences.update(rows)
+
+        return sequences
+
+    def add(self, stable_id, release, sequence):
+        return self.add_many([ (stable_id, release, sequence) ])
+
+    def add_many(self, entries):
+        """
+        Store the (stable ID, release, sequence) entries in a single transaction,
+        return the number of entries
+        """
+
+        sequences = {}
+        identifiers = []
+        for stable_id, release, sequence in entries:
+            checksum = sequence_checksum(sequence)
+            sequences[checksum] = sequence
+            identifiers.append((stable_id, int(release), checksum))
+
+        connection = self._connection()
+        with connection:
+            connection.executemany('INSERT OR IGNORE INTO sequence (checksum, sequence) VALUES (?, ?)', sequences.items())
+            connection.executemany('INSERT OR REPLACE INTO stable_id (stable_id, release, checksum) VALUES (?, ?, ?)', identifiers)
+
+        return len(identifiers)
+
+sequence_store = SequenceStore(settings.SEQUENCE_STORE_PATH) if settings.SEQUENCE_STORE_PATH else None
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+
+from restui.models.mappings import MappingView
+
+logger = logging.getLogger(__name__)
+
+#
+# The mapping_view columns served as suggestions, and the type they're reported as
+#
+SUGGEST_FIELDS = (('ensg_id', 'ensgId'),
+                  ('enst_id', 'enstId'),
+                  ('uniprot_acc', 'uniprotAccession'),
+                  ('gene_symbol_up', 'geneSymbol'),
+                  ('gene_symbol_eg', 'geneSymbol'),
+                  ('gene_name', 'geneName'))
+
+
+class SuggestIndex(object):
+    """
+    In-memory prefix index of the identifiers and names which can be searched
+    for in mapping_view, to suggest search terms while the user is typing.
+
+    The index is a sorted array of the upper case terms plus a parallel array of
+    the (term, type) suggestions, so a prefix lookup is a binary search followed
+    by a scan of the matching range.
+
+    The index is built in the background on first use, or when the WSGI
+    worker starts if SUGGEST_INDEX_PRELOAD (see gifts_rest/wsgi.py), then
+    rebuilt in the background when invalidated, i.e.
+    when a release has been loaded (see restui.signals), or when older than the
+    configured time to live, serving the previous index in the meantime, or no
+    suggestions until the first build is done.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index = None
+        self._built = None
+        self._building = False
+
+    def _build(self):
+        suggestions = set()
+        for field, suggestion_type in SUGGEST_FIELDS:
+            terms = MappingView.objects.exclude(**{ '{}__isnull'.format(field): True }).values_list(field, flat=True).distinct()
+            suggestions.update( (term, suggestion_type) for term in terms.iterator() if term )
+
+        suggestions = sorted( (term.upper(), term, suggestion_type) for term, suggestion_type in suggestions )
+
+        return ([ key for key, _, _ in suggestions ],
+                [ (term, suggestion_type) for _, term, suggestion_type in suggestions ])
+
+    def _rebuild(self):
+        try:
+            index = self._build()
+
+            with self._lock:
+                self._index = index
+                self._built = time.monotonic()
+        except Exception:
+            logger.warning("Cannot build the search suggestions index", exc_info=True)
+        finally:
+            with self._lock:
+                self._building = False
+
+            # the thread has its own database connections
+            connections.close_all()
+
+    def _start_rebuild(self):
+        # called with the lock held
+        self._building = True
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def preload(self):
+        """
+        Start building the index in the background, unless already built or building
+        """
+
+        with self._lock:
+            if self._index is None and not self._building:
+                self._start_rebuild()
+
+    def _current(self):
+        with self._lock:
+            stale = self._built is None or (self.ttl is not None and self._built + self.ttl < time.monotonic())
+            if stale and not self._building:
+                self._start_rebuild()
+
+            # None until the first build is done
+            return self._index
+
+    def invalidate(self):
+        """
+        Rebuild the index on next access, serving the current one until done
+        """
+
+        with self._lock:
+            self._built = None
+
+    def suggest(self, prefix, limit=10):
+        """
+        Return up to limit (term, type) suggestions starting with the given prefix (case insensitive)
+        """
+
+        index = self._current()
+        if not prefix or index is None:
+            return []
+
+        keys, suggestions = index
+        prefix = prefix.upper()
+
+        matches = []
+        position = bisect_left(keys, prefix)
+        while position < len(keys) and len(matches) < limit and keys[position].startswith(prefix):
+            matches.append(suggestions[position])
+            position += 1
+
+        return matches
+
+suggest_index = SuggestIndex(ttl=settings.SUGGEST_INDEX_TTL)
@@ -0,0 +1,131 @@
+import threading
+import time
+
+from django.conf import settings
+
+from restui.models.ensembl import EnsemblSpeciesHistory
+from restui.models.other import TaxonomyMapping
+
+
+class TaxonomyRegistry(object):
+    """
+    In-process registry of the species known to the database, i.e. for each
+    Ensembl tax id the latest species history (preferring the ones which have
+    completed loading), plus the UniProt to Ensembl tax id mapping.
+
+    The registry is loaded on first access and reloaded when invalidated, which
+    happens when a species history reaches LOAD_COMPLETE (see restui.signals),
+    or when older than the configured time to live, which bounds the staleness
+    in the processes which didn't see the load. The previous registry is served
+    while reloading.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._histories = None
+        self._tax_ids = None
+        self._loaded = None
+        self._loading = False
+        self._invalidations = 0
+
+    def _load(self):
+        histories = {}
+        for history in EnsemblSpeciesHistory.objects.filter(ensembl_tax_id__isnull=False).order_by('time_loaded'):
+            current = histories.get(history.ensembl_tax_id)
+            if current is None or history.status == 'LOAD_COMPLETE' or current.status != 'LOAD_COMPLETE':
+                histories[history.ensembl_tax_id] = history
+
+        tax_ids = dict(TaxonomyMapping.objects.filter(uniprot_tax_id__isnull=False,
+                                                      ensembl_tax_id__isnull=False).values_list('uniprot_tax_id', 'ensembl_tax_id'))
+
+        return histories, tax_ids
+
+    def _registry(self):
+        # a single thread (re)loads the registry, outside of the lock, while
+        # the others keep being served the previous one, or wait for the first
+        with self._condition:
+            while True:
+                fresh = self._loaded is not None and (self.ttl is None or self._loaded + self.ttl >= time.monotonic())
+                if fresh or (self._loading and self._histories is not None):
+                    return self._histories, self._tax_ids
+
+                if not self._loading:
+                    break
+
+                self._condition.wait()
+
+            self._loading = True
+            invalidations = self._invalidations
+
+        try:
+            histories, tax_ids = self._load()
+        except:
+            with self._condition:
+                self._loading = False
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            self._histories, self._tax_ids = histories, tax_ids
+            # invalidated while loading, the load may have missed the change
+            self._loaded = time.monotonic() if invalidations == self._invalidations else None
+            self._loading = False
+            self._condition.notify_all()
+
+        return histories, tax_ids
+
+    def invalidate(self):
+        """
+        Force a reload on next access
+        """
+
+        with self._condition:
+            self._loaded = None
+            self._invalidations += 1
+
+    def history(self, ensembl_tax_id):
+        """
+        Return the latest EnsemblSpeciesHistory for the given Ensembl tax id, None if unknown
+        """
+
+        histories, _ = self._registry()
+
+        return histories.get(ensembl_tax_id)
+
+    def ensembl_tax_id(self, uniprot_tax_id):
+        """
+        Return the Ensembl tax id corresponding to the given UniProt one,
+        assumed to be the same if there's no explicit mapping
+        """
+
+        _, tax_ids = self._registry()
+
+        return tax_ids.get(uniprot_tax_id, uniprot_tax_id)
+
+    def species(self, uniprot_tax_id):
+        """
+        Return the (Ensembl) species name for the given UniProt tax id, None if unknown
+        """
+
+        history = self.history(self.ensembl_tax_id(uniprot_tax_id))
+
+        return history.species if history is not None else None
+
+    def taxonomy(self, uniprot_tax_id):
+        """
+        Return the taxonomy data (as in TaxonomySerializer) for the given UniProt tax id
+        """
+
+        history = self.history(self.ensembl_tax_id(uniprot_tax_id))
+        if history is None:
+            return { 'species':None,
+                     'ensemblTaxId':None,
+                     'uniprotTaxId':uniprot_tax_id }
+
+        return { 'species':history.species,
+                 'ensemblTaxId':history.ensembl_tax_id,
+                 'uniprotTaxId':uniprot_tax_id }
+
+taxonomy_registry = TaxonomyRegistry(ttl=settings.TAXONOMY_REGISTRY_TTL)
@@ -0,0 +1,88 @@
+from restui.models.mappings import Mapping, MappingHistory
+
+
+class UnitOfWork(object):
+    """
+    Request-scoped identity map of the Mapping, MappingHistory, ReleaseMappingHistory
+    and EnsemblSpeciesHistory objects, shared by the helpers building a response
+    so that each entity is fetched once per request and there's a single instance
+    of it, whichever way it's been reached.
+    """
+
+    def __init__(self):
+        self._identity_map = {}
+        self._mapping_histories = {}
+
+    def register(self, instance):
+        """
+        Add the given instance to the identity map, return the instance already
+        registered for the same entity if any
+        """
+
+        return self._identity_map.setdefault((type(instance), instance.pk), instance)
+
+    def get(self, model, pk, queryset=None):
+        """
+        Return the instance of model with the given primary key, fetched once
+        (from the given queryset if provided), raise model.DoesNotExist if not found
+        """
+
+        try:
+            return self._identity_map[(model, pk)]
+        except KeyError:
+            pass
+
+        instance = (queryset if queryset is not None else model.objects).get(pk=pk)
+
+        return self.register(instance)
+
+    def mapping(self, pk):
+        return self.get(Mapping, pk, queryset=Mapping.objects.select_related('uniprot', 'transcript__gene'))
+
+    def mapping_histories(self, mapping):
+        """
+        Return all the mapping histories of the given mapping, with their release
+        mapping history and ensembl species history (registered as well)
+        """
+
+        try:
+            return self._mapping_histories[mapping.mapping_id]
+        except KeyError:
+            pass
+
+        mapping_histories = []
+        for mapping_history in mapping.mapping_history.select_related('release_mapping_history__ensembl_species_history'):
+            release_mapping_history = self.register(mapping_history.release_mapping_history)
+            if release_mapping_history.ensembl_species_history is not None:
+                release_mapping_history.ensembl_species_history = self.register(release_mapping_history.ensembl_species_history)
+            mapping_history.release_mapping_history = release_mapping_history
+
+            mapping_histories.append(self.register(mapping_history))
+
+        self._mapping_histories[mapping.mapping_id] = mapping_histories
+
+        return mapping_histories
+
+    def latest_mapping_history(self, mapping):
+        """
+        Return the mapping history of the given mapping for the most recent release,
+        i.e. as mapping.mapping_history.latest('release_mapping_history__time_mapped')
+        """
+
+        mapping_histories = self.mapping_histories(mapping)
+        if not mapping_histories:
+            raise MappingHistory.DoesNotExist
+
+        return max(mapping_histories, key=lambda mapping_history: mapping_history.release_mapping_history.time_mapped)
+
+    def last_mapping_history(self, mapping):
+        """
+        Return the last inserted mapping history of the given mapping,
+        i.e. as mapping.mapping_history.latest('mapping_history_id')
+        """
+
+        mapping_histories = self.mapping_histories(mapping)
+        if not mapping_histories:
+            raise MappingHistory.DoesNotExist
+
+        return max(mapping_histories, key=lambda mapping_history: mapping_history.mapping_history_id)
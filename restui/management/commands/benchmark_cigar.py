@@ -0,0 +1,71 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from restui.lib import cigar
+from restui.lib.alignments import calculate_difference
+
+def synthetic_cigar(rng):
+    """
+    Return a cigarplus string resembling a UniProt/Ensembl protein identity
+    alignment: a few hundred residues, mostly matches with scattered
+    mismatches and short indels
+    """
+
+    ops = []
+    length = rng.randint(100, 1000)
+    while length > 0:
+        matches = min(length, int(rng.expovariate(1 / 40)) + 1)
+        ops.append('{}M'.format(matches))
+        length -= matches
+
+        if length > 0:
+            op = rng.choices('XID', weights=(8, 1, 1))[0]
+            count = rng.randint(1, 3) if op == 'X' else rng.randint(1, 12)
+            ops.append('{}{}'.format(count, op))
+            if op != 'D':
+                length -= count
+
+    return ''.join(ops)
+
+class Command(BaseCommand):
+    help = "Compare the batch CIGAR differences (restui.lib.cigar) against the per-string calculate_difference"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help="Number of synthetic cigarplus strings")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--repeat', type=int, default=3, help="Best of this number of runs")
+
+    def best_of(self, repeat, fn, *args):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn(*args)
+            timings.append(time.perf_counter() - start)
+
+        return min(timings), result
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        cigars = [ synthetic_cigar(rng) for _ in range(options['count']) ]
+        repeat = options['repeat']
+
+        print("{} cigars, {} operations, NumPy {}".format(len(cigars), sum(c.count('M') + c.count('X') + c.count('I') + c.count('D') for c in cigars),
+                                                           'available' if cigar.np is not None else 'not available'))
+
+        loop_time, expected = self.best_of(repeat, lambda cigars: [ calculate_difference(c) for c in cigars ], cigars)
+        print("per-string calculate_difference: {:.3f}s".format(loop_time))
+
+        batch_time, differences = self.best_of(repeat, cigar.cigar_differences, cigars)
+        if list(differences) != expected:
+            raise CommandError("The batch differences don't match calculate_difference")
+        print("batch cigar_differences:         {:.3f}s ({:.1f}x)".format(batch_time, loop_time / batch_time))
+
+        stats_time, _ = self.best_of(repeat, cigar.cigar_stats, cigars)
+        print("batch cigar_stats:               {:.3f}s ({:.1f}x)".format(stats_time, loop_time / stats_time))
+
+        fallback_time, stats = self.best_of(repeat, cigar._cigar_stats_python, cigars)
+        if stats.differences != expected:
+            raise CommandError("The fallback differences don't match calculate_difference")
+        print("pure Python cigar_stats:         {:.3f}s ({:.1f}x)".format(fallback_time, loop_time / fallback_time))
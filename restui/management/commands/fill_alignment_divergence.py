@@ -1,18 +1,74 @@
+import os
+import time
+from multiprocessing import Pool
+
 from django.core.management.base import BaseCommand
+from django.db import connections
 
-from restui.models.mappings import Mapping
+from restui.lib.divergence import count_mappings, fill_chunk, stream_mapping_alignments
+from restui.lib.facets import refresh_summary_facets
 
 class Command(BaseCommand):
-    
+    help = "Back-fill the protein alignment divergence (alignment_difference) of the mappings and of mapping_view"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--release', type=int, help="Only the mappings of this Ensembl release")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Number of mappings updated per transaction")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of processes computing/writing the differences")
+        parser.add_argument('--checkpoint', help="File recording the last mapping_id done (default: /tmp/fill_alignment_divergence[_<release>].checkpoint)")
+        parser.add_argument('--resume', action='store_true', help="Start after the mapping_id recorded in the checkpoint file")
+
+    def read_checkpoint(self, filename):
+        try:
+            with open(filename) as checkpoint:
+                return int(checkpoint.read().strip())
+        except (IOError, ValueError):
+            return 0
+
+    def write_checkpoint(self, filename, mapping_id):
+        with open(filename + '.tmp', 'w') as checkpoint:
+            checkpoint.write(str(mapping_id))
+        os.replace(filename + '.tmp', filename)
+
     def handle(self, *args, **options):
-        print("Back-filling protein alignment divergence")
-        
-        mappings = Mapping.objects.all()
-        
-        for mapping in mappings:
-            print("Mapping id {}".format(mapping.mapping_id))
-            difference = mapping.difference
-            
-            mapping.alignment_difference = difference
-            
-            mapping.save()
+        release = options['release']
+        checkpoint = options['checkpoint'] or '/tmp/fill_alignment_divergence{}.checkpoint'.format('_{}'.format(release) if release is not None else '')
+
+        after = self.read_checkpoint(checkpoint) if options['resume'] else 0
+        total = count_mappings(after=after, release=release)
+
+        print("Back-filling protein alignment divergence of {} mappings{}{}".format(total,
+                                                                                     " (release {})".format(release) if release is not None else '',
+                                                                                     ", resuming after mapping id {}".format(after) if after else ''))
+
+        # fork the workers before streaming, they mustn't share the database connection
+        pool = None
+        if options['workers'] > 1:
+            connections.close_all()
+            pool = Pool(options['workers'])
+
+        chunks = stream_mapping_alignments(options['chunk_size'], after=after, release=release)
+        results = pool.imap(fill_chunk, chunks) if pool is not None else map(fill_chunk, chunks)
+
+        done = updated = 0
+        start = time.monotonic()
+        try:
+            # results come in order, so the checkpoint is always safe to resume from
+            for last_mapping_id, mappings, changed in results:
+                done += mappings
+                updated += changed
+                self.write_checkpoint(checkpoint, last_mapping_id)
+
+                elapsed = time.monotonic() - start
+                print("{}/{} mappings done ({} changed), {:.0f} mappings/s, last mapping id {}".format(done, total, updated, done / elapsed if elapsed else 0, last_mapping_id))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        print("Done, {} mappings changed".format(updated))
+
+        if updated:
+            # the divergence facets of a browse with no search term come from the summary
+            refresh_summary_facets()
+            print("mapping_view_facets refreshed")
@@ -0,0 +1,89 @@
+import gzip
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from restui.lib.external import ensembl_sequences
+from restui.lib.identifiers import loaded_transcripts
+from restui.lib.sequence_store import sequence_store
+
+# Ensembl stable IDs in FASTA headers are versioned, the REST lookups aren't
+VERSIONED_ID = re.compile(r"^(ENS[A-Z]*\d{11})\.\d+$")
+
+def read_fasta(filename):
+    """
+    Yield the (stable ID, sequence) records of a FASTA file, gzipped or not
+    """
+
+    opener = gzip.open if filename.endswith('.gz') else open
+
+    with opener(filename, 'rt') as fasta:
+        stable_id = None
+        chunks = []
+        for line in fasta:
+            line = line.strip()
+            if line.startswith('>'):
+                if stable_id is not None:
+                    yield stable_id, ''.join(chunks)
+
+                stable_id = line[1:].split()[0]
+                match = VERSIONED_ID.match(stable_id)
+                if match:
+                    stable_id = match.group(1)
+                chunks = []
+            elif line:
+                chunks.append(line)
+
+        if stable_id is not None:
+            yield stable_id, ''.join(chunks)
+
+class Command(BaseCommand):
+    help = "Load the sequences of an Ensembl release (e.g. the pep FASTA files, the transcripts) into the local sequence store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--release', type=int, required=True, help="Ensembl release of the sequences")
+        parser.add_argument('--fasta', nargs='+', default=[], help="FASTA file(s), optionally gzipped")
+        parser.add_argument('--transcripts', action='store_true',
+                            help="Load the sequences of the transcripts of the release loaded in the database, as looked up by ENST ID "
+                                 "(the Ensembl REST genomic sequences, not in the FASTA files), from Ensembl REST in batch")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Number of sequences stored per transaction")
+
+    def handle(self, *args, **options):
+        if sequence_store is None:
+            raise CommandError("The sequence store is disabled (SEQUENCE_STORE_PATH)")
+
+        if not options['fasta'] and not options['transcripts']:
+            raise CommandError("Nothing to load, give --fasta and/or --transcripts")
+
+        release = options['release']
+        batch_size = options['batch_size']
+
+        total = 0
+        for filename in options['fasta']:
+            print("Loading sequences from {} (release {})".format(filename, release))
+
+            batch = []
+            for stable_id, sequence in read_fasta(filename):
+                batch.append((stable_id, release, sequence))
+                if len(batch) == batch_size:
+                    total += sequence_store.add_many(batch)
+                    batch = []
+                    print("{} sequences loaded".format(total))
+
+            if batch:
+                total += sequence_store.add_many(batch)
+
+        if options['transcripts']:
+            enst_ids = sorted(loaded_transcripts(release))
+            print("Loading the sequences of {} transcripts (release {}) from Ensembl REST".format(len(enst_ids), release))
+
+            for start in range(0, len(enst_ids), batch_size):
+                chunk = enst_ids[start:start+batch_size]
+
+                # those already stored are skipped
+                stored = sequence_store.get_many(chunk, release)
+                fetched = ensembl_sequences([ enst_id for enst_id in chunk if enst_id not in stored ], release)
+                total += len(stored) + sequence_store.add_many( (enst_id, release, sequence) for enst_id, sequence in fetched.items() )
+                print("{}/{} transcripts done".format(min(start + batch_size, len(enst_ids)), len(enst_ids)))
+
+        print("Done, {} sequences loaded into {}".format(total, sequence_store.path))
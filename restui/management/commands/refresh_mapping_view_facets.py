@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restui.lib.facets import refresh_summary_facets
+from restui.models.mappings import MappingViewFacets
+
+class Command(BaseCommand):
+    help = "Recompute the mapping_view_facets summary the facets of a browse with no search term are served from"
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        refresh_summary_facets()
+
+        print("mapping_view_facets refreshed in {:.1f}s, {} rows".format(time.monotonic() - start, MappingViewFacets.objects.count()))
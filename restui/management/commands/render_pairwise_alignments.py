@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from restui.lib.alignments import fetch_pairwise_many
+from restui.models.mappings import Alignment, Mapping
+
+class Command(BaseCommand):
+    help = "Render and store the pairwise alignments of the mappings aligned against an Ensembl release"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--release', type=int, required=True, help="Ensembl release of the alignment runs")
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of mappings rendered at a time")
+
+    def handle(self, *args, **options):
+        release = options['release']
+        batch_size = options['batch_size']
+
+        # the mappings with an identity or perfect match alignment, i.e. of the
+        # kinds rendered (see pairwise_alignments_used), with no EnspUPairwise yet;
+        # the mappings whose only unrendered alignments are of other kinds are skipped
+        rendered_alignments = Q(alignment_run__score1_type='identity') | Q(alignment_run__score1_type='perfect_match', score1=1)
+        mapping_ids = list(Alignment.objects.filter(rendered_alignments,
+                                                    alignment_run__ensembl_release=release,
+                                                    mapping__isnull=False,
+                                                    rendered_pairwise__isnull=True).values_list('mapping_id', flat=True).distinct().order_by('mapping_id'))
+
+        print("Rendering the pairwise alignments of {} mappings (release {})".format(len(mapping_ids), release))
+
+        failed = 0
+        for start in range(0, len(mapping_ids), batch_size):
+            mappings = list(Mapping.objects.filter(pk__in=mapping_ids[start:start+batch_size])
+                                           .select_related('transcript', 'uniprot')
+                                           .prefetch_related('alignments__alignment_run', 'alignments__pairwise'))
+
+            try:
+                fetch_pairwise_many(mappings)
+            except Exception:
+                # isolate the mappings which can't be rendered
+                for mapping in mappings:
+                    try:
+                        fetch_pairwise_many([ mapping ])
+                    except Exception as e:
+                        failed += 1
+                        print("Mapping id {}: {}".format(mapping.mapping_id, e))
+
+            print("{}/{} mappings done".format(min(start + batch_size, len(mapping_ids)), len(mapping_ids)))
+
+        print("Done, {} mappings failed".format(failed))
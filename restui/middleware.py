@@ -0,0 +1,16 @@
+from restui.lib.divergence import differences_scope
+
+
+class DifferencesScopeMiddleware(object):
+    """
+    Resolve the alignment differences of the mappings (Mapping/MappingView.difference)
+    once per request, i.e. share a DifferenceResolver between all the lookups
+    made while handling and rendering the response
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with differences_scope():
+            return self.get_response(request)
@@ -1,4 +1,4 @@
-from .ensembl import EnsemblGene, EnsemblSpeciesHistory, EnsemblTranscript, EnspUCigar, GeneHistory, TranscriptHistory
+from .ensembl import EnsemblGene, EnsemblSpeciesHistory, EnsemblTranscript, EnspUCigar, EnspUPairwise, GeneHistory, TranscriptHistory
 from .mappings import Alignment, AlignmentRun, Mapping, MappingHistory, ReleaseMappingHistory
 from .uniprot import Domain, Isoform, Ptm, UniprotEntry, UniprotEntryHistory
 from .annotations import CvEntryType, CvUeLabel, CvUeStatus, UeMappingComment, UeMappingLabel, UeMappingStatus
@@ -146,6 +146,26 @@ class EnspUCigar(models.Model):
         managed = False
         db_table = 'ensp_u_cigar'
 
+class EnspUPairwise(PostgresModel):
+    """
+    The pairwise alignment rendered from the cigarplus/mdz of an alignment
+    and the Ensembl protein sequence, see restui.lib.alignments
+    """
+
+    objects = PostgresManager()
+
+    alignment = models.OneToOneField('Alignment', primary_key=True, on_delete=CASCADE, related_name='rendered_pairwise')
+    ensp_id = models.CharField(max_length=30)
+    alignment_type = models.CharField(max_length=30)
+    uniprot_alignment = models.TextField()
+    ensembl_alignment = models.TextField()
+    match_str = models.TextField()
+    time_rendered = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        managed = False
+        db_table = 'ensp_u_pairwise'
+
 
 class GeneHistory(PostgresModel):
     objects = PostgresManager()
@@ -1,12 +1,27 @@
-from collections import defaultdict
+import json
+from collections import defaultdict, OrderedDict
 
-from django.db import models
-from django.db.models import Count, Case, When
+from django.db import connections, models, router
+from django.db.models import Count, Case, When, Max, Q
 
-from restui.lib.alignments import calculate_difference
 from django.template.defaultfilters import default
-from restui.models.annotations import CvEntryType, CvUeStatus
+from restui.models.annotations import CvEntryType, CvUeStatus, UeMappingStatus
 from restui.models.ensembl import EnsemblSpeciesHistory
+from restui.lib.taxonomy import taxonomy_registry
+
+#
+# The latest mapping history of each of a list of mappings
+#
+LATEST_MAPPING_HISTORY_SQL = """
+SELECT mapping_id, grouping_id, release_mapping_history_id, uniprot_taxid
+  FROM (SELECT mh.mapping_id, mh.grouping_id, mh.release_mapping_history_id, rmh.uniprot_taxid,
+               ROW_NUMBER() OVER (PARTITION BY mh.mapping_id
+                                  ORDER BY rmh.time_mapped DESC, mh.mapping_history_id DESC) AS position
+          FROM mapping_history mh
+          JOIN release_mapping_history rmh ON rmh.release_mapping_history_id = mh.release_mapping_history_id
+         WHERE mh.mapping_id = ANY(%s)) latest
+ WHERE position = 1
+"""
 
 class Alignment(models.Model):
     alignment_id = models.BigAutoField(primary_key=True)
@@ -87,13 +102,19 @@ class MappingQuerySet(models.query.QuerySet):
             
         qs_limit = sum(int(row['total']) for row in counts[offset:offset+limit])
 
-        sub_qs = self.select_related('uniprot').select_related('transcript').select_related('transcript__gene').order_by('mapping_history__grouping_id')[qs_offset:qs_offset+qs_limit]
-        
+        sub_qs = list(self.select_related('uniprot').select_related('transcript').select_related('transcript__gene').order_by('mapping_history__grouping_id')[qs_offset:qs_offset+qs_limit])
+
+        # the grouping_id, release and species of the latest mapping history
+        # of each mapping of the slice, all from the same record
+        latest_mapping_history = MappingHistory.latest_per_mapping(set( result.mapping_id for result in sub_qs ), using=self.db)
+
+        species_latest_rmh = ReleaseMappingHistory.latest_per_species()
+
         grouped_results = {}
         grouped_results_added = defaultdict(set) # there are duplicates in each group, don't know yet why
 
         for result in sub_qs:
-            grouping_id = result.mapping_history.latest('release_mapping_history__time_mapped').grouping_id
+            grouping_id, release_mapping_history_id, uniprot_taxid = latest_mapping_history.get(result.mapping_id, (None, None, None))
 
             # skip if the mapping has already been added to the group
             if result.mapping_id in grouped_results_added[grouping_id]:
@@ -101,11 +122,7 @@ class MappingQuerySet(models.query.QuerySet):
 
             # a mapping might refer to an older release mapping history,
             # keep only those relative to the most recent for a certain species
-            result_rmh = result.mapping_history.latest('release_mapping_history__time_mapped').release_mapping_history
-            result_species = result_rmh.uniprot_taxid
-            species_latest_rmh = ReleaseMappingHistory.objects.filter(uniprot_taxid=result_species).latest('time_mapped')
-
-            if result_rmh != species_latest_rmh:
+            if release_mapping_history_id != species_latest_rmh.get(uniprot_taxid):
                 continue
 
             try:
@@ -175,25 +192,18 @@ class Mapping(models.Model):
 
     @property
     def difference(self):
-        diff_count = None
-        
-        for alignment in self.alignments.all():
-            if alignment.alignment_run.score1_type == 'perfect_match' and alignment.score1 == 1:
-                return 0;
-            
-            elif alignment.alignment_run.score1_type == 'identity':
-                diff_count = calculate_difference(alignment.pairwise.cigarplus)
-                
-        if diff_count:
-            return diff_count
-        
-        return None
+        # imported here as it depends on this module
+        from restui.lib.divergence import scoped_resolver
+
+        return scoped_resolver().difference(self.mapping_id)
 
     def statuses(self, usernames=False):
         """
         Return a list of all the status history of this mapping
         """
         status_set = self.status_history.order_by('time_stamp')
+        if usernames:
+            status_set = status_set.select_related('user_stamp')
         statuses = []
 
         for status in status_set:
@@ -202,7 +212,7 @@ class Mapping(models.Model):
             else:
                 user = None
 
-            statuses.append({'status': Mapping.status_type(status.status.id), 'time_stamp': status.time_stamp, 'user': user})
+            statuses.append({'status': Mapping.status_type(status.status_id), 'time_stamp': status.time_stamp, 'user': user})
 
         return statuses
 
@@ -233,6 +243,19 @@ class Mapping(models.Model):
 
         return cls._status_type[id]
 
+    @classmethod
+    def latest_mapping_histories(cls, mapping_ids):
+        """
+        Return the latest mapping history of each of the given mappings, with their
+        release mapping history and ensembl species history, i.e. a dict
+        mapping_id -> MappingHistory, with a single query
+        """
+
+        mapping_histories = MappingHistory.objects.filter(mapping_id__in=list(mapping_ids)).select_related(
+            'release_mapping_history__ensembl_species_history').order_by('mapping_id', '-mapping_history_id').distinct('mapping_id')
+
+        return { mapping_history.mapping_id: mapping_history for mapping_history in mapping_histories }
+
     def __str__(self):
         return "{0} - ({1}, {2})".format(self.mapping_id, self.uniprot, self.transcript)
 
@@ -299,6 +322,103 @@ class MappingViewQuerySet(models.query.QuerySet):
 
         return grouped_results
 
+    def grouped_keyset_slice(self, cursor, limit):
+        """
+        Fetch a subset of MappingView records grouped by unique grouping_id,
+        starting from the first group after cursor, i.e. the last grouping_id
+        seen by the client (groups come in descending grouping_id order).
+
+        Unlike grouped_slice, the records in the preceding groups don't need to
+        be counted: the next limit grouping_ids are found with a range query on
+        grouping_id and their records are fetched with a second query, so the
+        cost of a page doesn't depend on how deep it is in the result set.
+
+        Return a tuple with the groups, packaged as in grouped_slice, and the
+        cursor to fetch the following page (None if there are no more groups)
+        """
+        grouped_results = {}
+
+        # records with no grouping_id come first (NULLS FIRST in descending order)
+        # and make up a single group, consistently with grouped_counts
+        if cursor is None:
+            ungrouped = list(self.filter(grouping_id__isnull=True))
+            if ungrouped:
+                grouped_results[None] = ungrouped
+                limit -= 1
+
+                if limit == 0:
+                    max_grouping_id = self.aggregate(Max('grouping_id'))['grouping_id__max']
+                    next_cursor = max_grouping_id + 1 if max_grouping_id is not None else None
+
+                    return grouped_results, next_cursor
+
+        groups_qs = self.filter(grouping_id__isnull=False)
+        if cursor is not None:
+            groups_qs = groups_qs.filter(grouping_id__lt=cursor)
+
+        # fetch one more grouping_id to know whether there's a following page
+        grouping_ids = list(groups_qs.order_by('-grouping_id').values_list('grouping_id', flat=True).distinct()[:limit+1])
+
+        next_cursor = None
+        if len(grouping_ids) > limit:
+            grouping_ids = grouping_ids[:limit]
+            next_cursor = grouping_ids[-1]
+
+        for grouping_id in grouping_ids:
+            grouped_results[grouping_id] = []
+
+        for result in self.filter(grouping_id__in=grouping_ids).order_by('-grouping_id'):
+            grouped_results[result.grouping_id].append(result)
+
+        return grouped_results, next_cursor
+
+    def grouped_offset_slice(self, offset, limit):
+        """
+        Fetch a subset of MappingView records grouped by unique grouping_id,
+        as grouped_slice, but without counting the records of all the groups:
+        the grouping_ids of the page are found by skipping offset distinct
+        grouping_ids and their records are fetched with a second query.
+
+        Return a tuple with the groups, packaged as in grouped_slice, and
+        whether there are more groups after them
+        """
+        grouping_ids = list(self.order_by('-grouping_id').values_list('grouping_id', flat=True).distinct()[offset:offset+limit+1])
+
+        has_more = len(grouping_ids) > limit
+        grouping_ids = grouping_ids[:limit]
+
+        grouped_results = OrderedDict( (grouping_id, []) for grouping_id in grouping_ids )
+        if not grouping_ids:
+            return grouped_results, has_more
+
+        # records with no grouping_id make up a single group
+        query_filter = Q(grouping_id__in=[ grouping_id for grouping_id in grouping_ids if grouping_id is not None ])
+        if None in grouped_results:
+            query_filter |= Q(grouping_id__isnull=True)
+
+        for result in self.filter(query_filter).order_by('-grouping_id'):
+            grouped_results[result.grouping_id].append(result)
+
+        return grouped_results, has_more
+
+    def estimated_grouped_count(self):
+        """
+        Estimate the total number of groups based on unique grouping_id from
+        the planner statistics, i.e. the number of rows the planner expects
+        when selecting the distinct grouping_ids of the queryset, which is
+        much cheaper than grouped_count on large unfiltered sets
+        """
+        sql, params = self.values('grouping_id').distinct().order_by().query.sql_with_params()
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]['Plan']['Plan Rows'])
+
     def statuses(self):
         """
         Return a list of all the statuses represented in this queryset
@@ -318,12 +438,7 @@ class MappingViewQuerySet(models.query.QuerySet):
         """
         species_set = self.values('uniprot_tax_id').distinct()
 
-        species_list = []
-        for species in species_set:
-            species_name = EnsemblSpeciesHistory.objects.filter(ensembl_tax_id=species['uniprot_tax_id']).latest('time_loaded').species
-            species_list.append((species['uniprot_tax_id'], species_name))
-
-        return species_list
+        return [ (species['uniprot_tax_id'], taxonomy_registry.species(species['uniprot_tax_id'])) for species in species_set ]
 
     def divergences(self):
         """
@@ -420,44 +535,65 @@ class MappingView(models.Model):
 
     @property
     def difference(self):
-        diff_count = None
-
-        try:
-            mapping = Mapping.objects.get(pk=self.mapping_id)
+        if self.mapping_id is None:
+            return None # No mapping ID: cannot get difference
 
-            for alignment in mapping.alignments.all():
-                if alignment.alignment_run.score1_type == 'perfect_match' and alignment.score1 == 1:
-                    return 0;
+        # imported here as it depends on this module
+        from restui.lib.divergence import scoped_resolver
 
-                elif alignment.alignment_run.score1_type == 'identity':
-                    diff_count = calculate_difference(alignment.pairwise.cigarplus)
-        except:
-            pass # No mapping ID: cannot get difference
-
-        return diff_count
+        return scoped_resolver().difference(self.mapping_id)
 
     def statuses(self, usernames=False):
         """
         Return a list of all the status history of a mapping
         """
 
-        statuses = []
+        return MappingView.status_histories([ self.mapping_id ], usernames=usernames).get(self.mapping_id, [])
 
-        try:
-            mapping = Mapping.objects.get(pk=self.mapping_id)
-            status_set = mapping.status_history.order_by('time_stamp')
+    @classmethod
+    def status_histories(cls, mapping_ids, usernames=False):
+        """
+        Return the status history of each of the given mappings, i.e. a dict
+        mapping_id -> list of statuses as in statuses(), with a single query
+        (plus their users) whatever the number of mappings, e.g. for a whole
+        page of search results
+        """
 
-            for status in status_set:
-                if usernames and status.user_stamp:
-                    user = status.user_stamp.full_name
-                else:
-                    user = None
+        # no mapping ID: cannot get status
+        histories = { mapping_id: [] for mapping_id in mapping_ids if mapping_id is not None }
+        if not histories:
+            return histories
 
-                    statuses.append({'status': MappingView.status_type(status.status.id), 'time_stamp': status.time_stamp, 'user': user})
-        except:
-            pass # no mapping ID: cannot get status
+        status_set = UeMappingStatus.objects.filter(mapping_id__in=list(histories)).order_by('time_stamp', 'id')
+        if usernames:
+            status_set = status_set.select_related('user_stamp')
 
-        return statuses
+        for status in status_set:
+            if usernames and status.user_stamp_id:
+                user = status.user_stamp.full_name
+            else:
+                user = None
+
+            histories[status.mapping_id].append({'status': cls.status_description(status.status_id), 'time_stamp': status.time_stamp, 'user': user})
+
+        return histories
+
+    @classmethod
+    def species_histories(cls, release_mapping_history_ids):
+        """
+        Return the ensembl species history of each of the given release mapping
+        histories, i.e. a dict release_mapping_history_id -> EnsemblSpeciesHistory,
+        with a single query
+        """
+
+        release_mapping_history_ids = set(rmh_id for rmh_id in release_mapping_history_ids if rmh_id is not None)
+        if not release_mapping_history_ids:
+            return {}
+
+        release_mapping_histories = ReleaseMappingHistory.objects.filter(pk__in=release_mapping_history_ids).select_related('ensembl_species_history')
+
+        return { rmh.release_mapping_history_id: rmh.ensembl_species_history
+                 for rmh in release_mapping_histories if rmh.ensembl_species_history is not None }
 
     '''
     The goal of these two functions is to reduce the number of database calls. Rather
@@ -500,6 +636,26 @@ class MappingView(models.Model):
     class Meta:
         managed = False
         db_table = 'mapping_view'
+
+class MappingViewFacets(models.Model):
+    """
+    Number of mapping_view entries per value of the facet columns, where
+    alignment_difference is capped at 6 and region_accession is 'CHR' for
+    the entries on patches (see schema/0008.sql)
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    uniprot_tax_id = models.BigIntegerField(blank=True, null=True)
+    status = models.BigIntegerField(blank=True, null=True)
+    uniprot_mapping_status = models.CharField(max_length=30, blank=True, null=True)
+    chromosome = models.CharField(max_length=50, blank=True, null=True)
+    alignment_difference = models.IntegerField(blank=True, null=True)
+    region_accession = models.CharField(max_length=50, blank=True, null=True)
+    total = models.BigIntegerField()
+
+    class Meta:
+        managed = False
+        db_table = 'mapping_view_facets'
 #
 #######################################################################################
 
@@ -514,6 +670,23 @@ class MappingHistory(models.Model):
     sp_ensembl_mapping_type = models.CharField(max_length=50, blank=True, null=True)
     grouping_id = models.BigIntegerField(blank=True, null=True)
 
+    @classmethod
+    def latest_per_mapping(cls, mapping_ids, using=None):
+        """
+        Return the grouping_id, release_mapping_history_id and uniprot_taxid of
+        the latest (by time mapped, then id) mapping history of each of the given
+        mappings, i.e. a dict mapping_id -> (grouping_id, release_mapping_history_id, uniprot_taxid)
+        """
+
+        if not mapping_ids:
+            return {}
+
+        with connections[using or router.db_for_read(cls)].cursor() as cursor:
+            cursor.execute(LATEST_MAPPING_HISTORY_SQL, [ list(mapping_ids) ])
+
+            return { mapping_id: (grouping_id, release_mapping_history_id, uniprot_taxid)
+                     for mapping_id, grouping_id, release_mapping_history_id, uniprot_taxid in cursor.fetchall() }
+
     class Meta:
         managed = False
         db_table = 'mapping_history'
@@ -526,6 +699,17 @@ class ReleaseMappingHistory(models.Model):
     uniprot_taxid = models.BigIntegerField(blank=True, null=True)
     status = models.CharField(max_length=20, blank=True, null=True)
 
+    @classmethod
+    def latest_per_species(cls):
+        """
+        Return the id of the latest (by time mapped) release mapping history
+        of each species, i.e. a dict uniprot_taxid -> release_mapping_history_id
+        """
+
+        latest = cls.objects.order_by('uniprot_taxid', '-time_mapped').distinct('uniprot_taxid')
+
+        return dict(latest.values_list('uniprot_taxid', 'release_mapping_history_id'))
+
     class Meta:
         managed = False
         db_table = 'release_mapping_history'
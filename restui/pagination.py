@@ -1,11 +1,17 @@
 import pprint
+from base64 import b64decode, b64encode
 from collections import OrderedDict
+from django.conf import settings
 from rest_framework.response import Response
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from restui.serializers.mappings import MappingsSerializer, MappingViewsSerializer
 from restui.serializers.unmapped import UnmappedEnsemblEntrySerializer
 from restui.models.mappings import Mapping, MappingView
+from restui.lib.facets import compute_facets, summary_facets
+from restui.lib.search import search_cache, search_signature
 from rest_framework import status
 #
 # TODO
@@ -81,30 +87,74 @@ class FacetPagination(LimitOffsetPagination):
         ]))
 
 class MappingViewFacetPagination(LimitOffsetPagination):
-    def create_facets(self, queryset):
+    """
+    Paginate mapping views by groups, either by limit/offset or, if the
+    'cursor' query parameter is given (empty for the first page), by
+    keyset on the last grouping_id seen, so that deep pages cost the
+    same as the first one. The total number of groups of a keyset page is
+    estimated (see below), unless already counted for the same search.
+
+    When browsing with no search term, the total number of groups is
+    estimated from the planner statistics (unless small), as counting them
+    requires a pass over the whole table, and the facets are served from the
+    mapping_view_facets summary for the same reason; 'exactCount=true' forces
+    an exact count and exact facets. Whether the count is estimated is
+    reported in the response.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    exact_count_query_param = 'exactCount'
+
+    def exact_count_requested(self, request):
+        return request.query_params.get(self.exact_count_query_param, '').lower() in ('true', '1')
+
+    def decode_cursor(self, request):
+        """
+        Return the grouping_id encoded in the request cursor, None for the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            return int(b64decode(encoded.encode('ascii')).decode('ascii'))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, grouping_id):
+        return b64encode(str(grouping_id).encode('ascii')).decode('ascii')
+
+    def create_facets(self, queryset, request):
         statuses = OrderedDict([('name','status'),('label','Status'),('items',[])])
         organism = OrderedDict([('name','organism'),('label','Organism'),('items',[])])
         sequence = OrderedDict([('name','alignment'),('label','Alignment'),('items',[])])
         types = OrderedDict([('name','type'),('label','Type'),('items',[])])
         patches = OrderedDict([('name','patches'),('label','Patches'),('items',[])])
 
-        if queryset.has_patches():
+        if self.summary_facets:
+            # like the count, the exact facets would need a pass over the whole table
+            facets = summary_facets(request.query_params.get('facets', None))
+        else:
+            facets = compute_facets(queryset)
+
+        if facets['patches']:
             patches["items"].append({'name':'include', 'label':'Include'})
             patches["items"].append({'name':'exclude', 'label':'Exclude'})
             patches["items"].append({'name':'only', 'label':'Only patches'})
-            
-        species_set = queryset.species()
+
+        species_set = facets['species']
         for species in species_set:
             organism["items"].append({ "name":species[0], "label":species[1] })
 
-        for status in queryset.statuses():
+        for status in facets['statuses']:
             try:
                 description = MappingView.status_description(status)
                 statuses["items"].append({ "name":description, "label":description.replace("_"," ").capitalize() })
             except:
                 pass
 
-        differences = queryset.divergences()
+        differences = facets['divergences']
         if differences[0]:
             sequence["items"].append({ "label": "Identical", "name": "identical", "count": differences[0] })
         if differences[1]:
@@ -112,13 +162,13 @@ class MappingViewFacetPagination(LimitOffsetPagination):
         if differences[2]:
             sequence["items"].append({ "label": "Large diff", "name": "large", "count": differences[2] })
 
-        for mapping_type in queryset.types():
+        for mapping_type in facets['types']:
             types["items"].append({ 'name':mapping_type, 'label':mapping_type.replace("_"," ").capitalize() })
 
         if len(species_set) == 1:
             chromosomes = OrderedDict([('name','chromosomes'),('label','Chromosomes'),('items',[])])
 
-            for chromosome in queryset.chromosomes():
+            for chromosome in facets['chromosomes']:
                 chromosomes["items"].append({ 'name':chromosome.lower(), 'label':chromosome.upper() })
 
             return [ statuses, organism, sequence, chromosomes, types, patches ]
@@ -127,28 +177,111 @@ class MappingViewFacetPagination(LimitOffsetPagination):
 
 
     def paginate_queryset(self, queryset, request, view=None):
-        self.count = queryset.grouped_count
+        # grouping_id counts and facets don't depend on the requested page,
+        # compute them once per search and reuse them when paging through
+        signature = search_signature(request.query_params.get('searchTerm', None),
+                                     request.query_params.get('facets', None))
+        cached = search_cache.get(signature, { 'counts': None, 'facets': None })
+
+        search_term = request.query_params.get('searchTerm', None)
+        self.cursor_mode = self.cursor_query_param in request.query_params
+
+        self.estimated = False
+        if cached['counts'] is None and not self.exact_count_requested(request):
+            if self.cursor_mode:
+                # keyset pages don't need the counts of the preceding groups,
+                # the total is only reported
+                self.count = queryset.estimated_grouped_count()
+                self.estimated = True
+            elif not search_term:
+                self.count = queryset.estimated_grouped_count()
+                self.estimated = self.count > settings.SEARCH_EXACT_COUNT_THRESHOLD
+
+        # the summary can't be filtered by search term
+        self.summary_facets = self.estimated and not search_term
+
+        if not self.estimated:
+            if cached['counts'] is None:
+                queryset._counts = list(queryset.grouped_counts())
+                # don't hold on to the counts of very large result sets
+                if len(queryset._counts) <= settings.SEARCH_CACHE_MAX_GROUPS:
+                    cached = dict(cached, counts=queryset._counts)
+                    search_cache.set(signature, cached)
+            else:
+                queryset._counts = cached['counts']
+
+            self.count = queryset.grouped_count
+
         self.limit = self.get_limit(request)
 
         if self.limit is None:
             return None
 
-        self.offset = self.get_offset(request)
+        if self.cursor_mode:
+            self.cursor = self.decode_cursor(request)
+            self.offset = 0
+        else:
+            self.offset = self.get_offset(request)
 
         self.request = request
         if self.count > self.limit and self.template is not None:
             self.display_page_controls = True
 
-        if self.count == 0 or self.offset > self.count:
+        if not self.estimated and (self.count == 0 or self.offset > self.count):
             return []
 
+        if self.cursor_mode:
+            groups, self.next_cursor = queryset.grouped_keyset_slice(self.cursor, self.limit)
+        elif self.estimated:
+            # the estimated count can't tell where the last page is
+            groups, self.has_more = queryset.grouped_offset_slice(self.offset, self.limit)
+        else:
+            groups = queryset.grouped_slice(self.offset, self.limit)
+
+        facets_key = 'estimated_facets' if self.summary_facets else 'facets'
+        self.facets = cached.get(facets_key)
+        if self.facets is None:
+            self.facets = self.create_facets(queryset, request)
+            search_cache.set(signature, dict(cached, **{ facets_key: self.facets }))
+
+        # load the status history and the species of all the mappings in the page at once
+        page = [ mapping_view for group in groups.values() for mapping_view in group ]
+        status_histories = MappingView.status_histories([ mapping_view.mapping_id for mapping_view in page ])
+        species_histories = MappingView.species_histories([ mapping_view.release_mapping_history_id for mapping_view in page ])
+
         mapping_groups = []
-        self.facets = self.create_facets(queryset)
-        for _, group in queryset.grouped_slice(self.offset, self.limit).items():
-            mapping_groups.append(MappingViewsSerializer.build_mapping_group(group))
+        for _, group in groups.items():
+            mapping_groups.append(MappingViewsSerializer.build_mapping_group(group, status_histories=status_histories,
+                                                                             species_histories=species_histories))
 
         return mapping_groups
 
+    def get_next_link(self):
+        if not self.cursor_mode:
+            if not self.estimated:
+                return super(MappingViewFacetPagination, self).get_next_link()
+
+            if not self.has_more:
+                return None
+
+            url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+
+            return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+        if self.next_cursor is None:
+            return None
+
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_cursor))
+
+    def get_previous_link(self):
+        # keyset pagination only goes forward
+        if self.cursor_mode:
+            return None
+
+        return super(MappingViewFacetPagination, self).get_previous_link()
+
     def get_paginated_response(self, data):
 
         if not data:
@@ -156,6 +289,7 @@ class MappingViewFacetPagination(LimitOffsetPagination):
 
         return Response(OrderedDict([
             ('count', self.count),
+            ('countEstimated', self.estimated),
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
             ('results', data),
@@ -1,13 +1,18 @@
+import logging
+from collections import defaultdict
+
 from rest_framework import serializers
 from django.http import Http404
 
-from restui.lib.external import ensembl_sequence
+from restui.lib.external import ensembl_sequence, ensembl_sequences
+from restui.lib.taxonomy import taxonomy_registry
 from restui.models.annotations import CvEntryType, CvUeStatus
 from restui.models.mappings import Mapping, MappingView, ReleaseMappingHistory, MappingHistory, ReleaseStats
-from restui.models.ensembl import EnsemblSpeciesHistory
 from restui.serializers.ensembl import SpeciesHistorySerializer
 from restui.serializers.annotations import StatusHistorySerializer
 
+logger = logging.getLogger(__name__)
+
 class TaxonomySerializer(serializers.Serializer):
     """
     For nested serialization of taxonomy in call to mapping/<id> endpoint.
@@ -139,15 +144,25 @@ class MappingsSerializer(serializers.Serializer):
     entryMappings = EnsemblUniprotMappingSerializer(many=True)
 
     @classmethod
-    def build_mapping(cls, mapping, fetch_sequence=False, authenticated=False): 
-        mapping_history = mapping.mapping_history.select_related('release_mapping_history').select_related('release_mapping_history__ensembl_species_history').latest('mapping_history_id')
+    def build_mapping(cls, mapping, fetch_sequence=False, authenticated=False, mapping_history=None, status_history=None, sequence=None):
+        """
+        mapping_history: the latest mapping history of the mapping, with its release
+        mapping history and ensembl species history, loaded if not provided
+        status_history: the status history of the mapping, loaded if not provided
+        sequence: the Ensembl sequence of the transcript, fetched if not provided and fetch_sequence
+        """
+
+        if mapping_history is None:
+            mapping_history = mapping.mapping_history.select_related('release_mapping_history').select_related('release_mapping_history__ensembl_species_history').latest('mapping_history_id')
         release_mapping_history = mapping_history.release_mapping_history
         ensembl_history = mapping_history.release_mapping_history.ensembl_species_history
-        
-        status = mapping.status.id
 
-        sequence = None
-        if fetch_sequence:
+        if status_history is None:
+            status_history = mapping.statuses(usernames=authenticated)
+
+        status = mapping.status_id
+
+        if fetch_sequence and sequence is None:
             try:
                 sequence = ensembl_sequence(mapping.transcript.enst_id, ensembl_history.ensembl_release)
             except Exception as e:
@@ -198,7 +213,7 @@ class MappingsSerializer(serializers.Serializer):
                             },
                        'alignment_difference': mapping.alignment_difference,
                        'status': Mapping.status_type(status),
-                       'status_history': mapping.statuses(usernames=authenticated)
+                       'status_history': status_history
                        }
 
         return mapping_obj
@@ -260,11 +275,21 @@ class MappingViewsSerializer(serializers.Serializer):
     entryMappings = EnsemblUniprotMappingSerializer(many=True)
 
     @classmethod
-    def build_mapping(cls, mapping_view, fetch_sequence=False, authenticated=False):
+    def build_mapping(cls, mapping_view, fetch_sequence=False, authenticated=False, status_history=None, sequences=None):
+        """
+        sequences: the sequences already fetched for the transcripts of the
+        mapping_view release (see build_mapping_group), if fetch_sequence
+        """
+
         status = mapping_view.status
 
+        if status_history is None:
+            status_history = mapping_view.statuses(usernames=authenticated)
+
         sequence = None
-        if fetch_sequence:
+        if fetch_sequence and sequences is not None:
+            sequence = sequences.get(mapping_view.enst_id)
+        elif fetch_sequence:
             try:
                 sequence = ensembl_sequence(mapping_view.enst_id, mapping_view.ensembl_release)
             except Exception as e:
@@ -317,37 +342,70 @@ class MappingViewsSerializer(serializers.Serializer):
                             },
                        'alignment_difference': mapping_view.alignment_difference,
                        'status': MappingView.status_description(status),
-                       'status_history': mapping_view.statuses(usernames=authenticated)
+                       'status_history': status_history
                        }
 
         return mapping_obj
 
     @classmethod
-    def build_mapping_group(cls, group, fetch_sequence=False):
-        mapping_set = { 'taxonomy':cls.build_taxonomy_data(group),
+    def build_mapping_group(cls, group, fetch_sequence=False, status_histories=None, species_histories=None):
+        """
+        status_histories: the status history of the mappings as returned by
+        MappingView.status_histories, loaded for the group if not provided
+        species_histories: the species history of the release mappings as returned
+        by MappingView.species_histories, loaded for the group if not provided
+        """
+
+        if status_histories is None:
+            status_histories = MappingView.status_histories([ mapping_view.mapping_id for mapping_view in group ])
+
+        mapping_set = { 'taxonomy':cls.build_taxonomy_data(group, species_histories=species_histories),
                         'entryMappings':[] }
 
+        # fetch the sequences of the group in batch, i.e. one or two requests per release
+        sequences = {}
+        if fetch_sequence:
+            transcripts_by_release = defaultdict(set)
+            for mapping_view in group:
+                if mapping_view.enst_id:
+                    transcripts_by_release[mapping_view.ensembl_release].add(mapping_view.enst_id)
+
+            for ensembl_release, enst_ids in transcripts_by_release.items():
+                try:
+                    sequences[ensembl_release] = ensembl_sequences(enst_ids, ensembl_release)
+                except Exception as e:
+                    logger.warning("Cannot fetch the sequences of %d transcripts (release %s): %s", len(enst_ids), ensembl_release, e)
+                    sequences[ensembl_release] = {}
+
         for mapping_view in group:
-            mapping_set['entryMappings'].append(cls.build_mapping(mapping_view, fetch_sequence=fetch_sequence))
+            mapping_set['entryMappings'].append(cls.build_mapping(mapping_view, fetch_sequence=fetch_sequence,
+                                                                 status_history=status_histories.get(mapping_view.mapping_id, []),
+                                                                 sequences=sequences.get(mapping_view.ensembl_release, {}) if fetch_sequence else None))
 
         return mapping_set
 
     @classmethod
-    def build_taxonomy_data(cls, group):
+    def build_taxonomy_data(cls, group, species_histories=None):
         """
         Find taxonomy information, i.e. ensembl/uniprot tax id/species for the group
+
+        species_histories: the species history of the release mappings as returned
+        by MappingView.species_histories, loaded for the group if not provided
         """
 
+        if species_histories is None:
+            species_histories = MappingView.species_histories([ mapping_view.release_mapping_history_id for mapping_view in group ])
+
         # if the group contains mapped and potentially unmapped data
         # return information from the first mapping with could find
         # taxonomy data from
         for mapping_view in group:
-            try:
-                mapping = Mapping.objects.get(pk=mapping_view.mapping_id)
-            except Mapping.DoesNotExist:
+            if mapping_view.mapping_id is None:
                 continue
 
-            ensembl_history = mapping.mapping_history.select_related('release_mapping_history').select_related('release_mapping_history__ensembl_species_history').latest('mapping_history_id').release_mapping_history.ensembl_species_history
+            ensembl_history = species_histories.get(mapping_view.release_mapping_history_id)
+            if ensembl_history is None:
+                continue
 
             return { 'species':ensembl_history.species,
                      'ensemblTaxId':ensembl_history.ensembl_tax_id,
@@ -358,12 +416,7 @@ class MappingViewsSerializer(serializers.Serializer):
         # return information only if the group refers to the same tax id
         tax_ids = [ mapping_view.uniprot_tax_id for mapping_view in group ]
         if len(tax_ids) == 1:
-            species_history = EnsemblSpeciesHistory.objects.filter(ensembl_tax_id=tax_ids[0]).latest('time_loaded')
-            return {
-                'species':species_history.species,
-                'ensemblTaxId': species_history.ensembl_tax_id,
-                'uniprotTaxId':group[0].uniprot_tax_id
-                }
+            return taxonomy_registry.taxonomy(tax_ids[0])
 
         return { 'species':None,
                  'ensemblTaxId':None,
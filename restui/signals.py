@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from restui.models.ensembl import EnsemblSpeciesHistory
+from restui.lib.taxonomy import taxonomy_registry
+from restui.lib.suggest import suggest_index
+
+
+@receiver(post_save, sender=EnsemblSpeciesHistory)
+def species_history_saved(sender, instance, **kwargs):
+    """
+    A new Ensembl release has been loaded for a species, reload the taxonomy
+    registry and the search suggestions
+    """
+
+    if instance.status == 'LOAD_COMPLETE':
+        taxonomy_registry.invalidate()
+        suggest_index.invalidate()
@@ -1,3 +1,783 @@
-from django.test import TestCase
+import http.server
+import io
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+from concurrent.futures import TimeoutError
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import mock, skipIf
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import requests
+
+from django.conf import settings
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from gifts_rest.http_client import DeadlineRetry, HTTPClient
+from restui.lib import alignments, cigar, concurrency, divergence, external, facets, identifiers, taxonomy
+from restui.management.commands import fill_alignment_divergence, populate_sequence_store
+from restui.middleware import DifferencesScopeMiddleware
+from restui.lib.sequence_store import SequenceStore
+from restui.models.ensembl import EnspUCigar, EnspUPairwise
+from restui.models.mappings import Mapping, MappingView
+from restui.views.ensembl import EnspUCigarFetchUpdateByAlignment
+from restui.pagination import MappingViewFacetPagination
+from restui.serializers.annotations import StatusHistorySerializer
+from restui.serializers.mappings import MappingViewsSerializer
+
+#
+# What the stand-in Ensembl REST server knows about
+#
+TRANSLATIONS = { 'ENST01': 'ENSP01', 'ENST02': 'ENSP02', 'ENST03': 'ENSP03', 'ENST04': None }
+SEQUENCES = { 'ENSP01': 'MKVL', 'ENSP02': 'MAAQ', 'ENSP03': 'MWWP' }
+GENOMIC_SEQUENCES = { 'ENST01': 'ATGAAGGTGTTAGGTAAG', 'ENST02': 'ATGGCCGCACAG' }
+
+
+class EnsemblStandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Minimal stand-in of the Ensembl REST endpoints used by restui.lib.external
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, None))
+
+        if self.path.startswith('/info/software'):
+            self.respond({ 'release': 95 })
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        ids = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())['ids']
+        self.server.requests.append(('POST', self.path, ids))
+
+        if self.path.startswith('/lookup/id'):
+            self.respond({ enst_id: ({ 'id': enst_id, 'Translation': { 'id': TRANSLATIONS[enst_id] } } if TRANSLATIONS.get(enst_id) else
+                                     { 'id': enst_id } if enst_id in TRANSLATIONS else None) for enst_id in ids })
+        elif self.path.startswith('/sequence/id'):
+            self.respond([ { 'query': stable_id, 'id': stable_id, 'seq': SEQUENCES[stable_id], 'molecule': 'protein' }
+                           for stable_id in ids if stable_id in SEQUENCES ] +
+                         [ { 'query': stable_id, 'id': stable_id, 'seq': GENOMIC_SEQUENCES[stable_id], 'molecule': 'dna' }
+                           for stable_id in ids if stable_id in GENOMIC_SEQUENCES ])
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+class EnsemblStandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class EnsemblBatchTestCase(SimpleTestCase):
+    """
+    Batch retrieval of the Ensembl translations/sequences against a stand-in server
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(EnsemblBatchTestCase, cls).setUpClass()
+
+        cls.server = EnsemblStandInServer(('127.0.0.1', 0), EnsemblStandInHandler)
+        cls.server.requests = []
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+        super(EnsemblBatchTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+
+        for cache in (external.release_cache, external.protein_cache, external.sequence_cache):
+            cache.clear()
+
+        patcher = mock.patch.multiple(external,
+                                      ENSEMBL_REST_SERVER='http://127.0.0.1:{}'.format(self.server.server_port),
+                                      ENSEMBL_LOOKUP_BATCH_SIZE=2,
+                                      ENSEMBL_SEQUENCE_BATCH_SIZE=2,
+                                      sequence_store=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # no transcript loaded in the database unless a test says so
+        patcher = mock.patch.object(identifiers, 'loaded_proteins', return_value={})
+        self.loaded_proteins = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def posts(self, endpoint):
+        return [ ids for method, path, ids in self.server.requests if method == 'POST' and path.startswith(endpoint) ]
+
+    def test_proteins_in_chunks(self):
+        proteins = external.ensembl_proteins(['ENST01', 'ENST02', 'ENST03', 'ENST04'], 95)
+
+        self.assertEqual(proteins, { 'ENST01': 'ENSP01', 'ENST02': 'ENSP02', 'ENST03': 'ENSP03' })
+        self.assertEqual(self.posts('/lookup/id'), [ ['ENST01', 'ENST02'], ['ENST03', 'ENST04'] ])
+
+    def test_proteins_cached(self):
+        external.ensembl_proteins(['ENST01', 'ENST02'], 95)
+        self.server.requests.clear()
+
+        proteins = external.ensembl_proteins(['ENST01', 'ENST02', 'ENST03'], 95)
+
+        self.assertEqual(proteins['ENST03'], 'ENSP03')
+        self.assertEqual(self.posts('/lookup/id'), [ ['ENST03'] ])
+        self.assertEqual(external.ensembl_protein('ENST01', 95), 'ENSP01')
+
+    def test_proteins_loaded_locally(self):
+        self.loaded_proteins.return_value = { 'ENST01': 'ENSP01', 'ENST04': None }
+
+        proteins = identifiers.resolve_proteins(['ENST01', 'ENST02', 'ENST04'], 95)
+
+        self.assertEqual(proteins, { 'ENST01': 'ENSP01', 'ENST02': 'ENSP02' })
+        self.assertEqual(self.posts('/lookup/id'), [ ['ENST02'] ])
+
+    def test_sequences_in_chunks(self):
+        sequences = external.ensembl_sequences(['ENSP01', 'ENSP02', 'ENSP03'], 95)
+
+        self.assertEqual(sequences, SEQUENCES)
+        self.assertEqual(self.posts('/sequence/id'), [ ['ENSP01', 'ENSP02'], ['ENSP03'] ])
+
+        self.server.requests.clear()
+        self.assertEqual(external.ensembl_sequence('ENSP02', 95), 'MAAQ')
+        self.assertEqual(self.server.requests, [])
+
+    def test_sequences_from_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        store = SequenceStore(os.path.join(directory, 'sequences.sqlite3'))
+        store.add('ENSP01', 95, 'MKVL')
+
+        with mock.patch.object(external, 'sequence_store', store):
+            sequences = external.ensembl_sequences(['ENSP01', 'ENSP02'], 95)
+
+        self.assertEqual(sequences, { 'ENSP01': 'MKVL', 'ENSP02': 'MAAQ' })
+        self.assertEqual(self.posts('/sequence/id'), [ ['ENSP02'] ])
+        # the request path only reads the store
+        self.assertIsNone(store.get('ENSP02', 95))
+
+    def test_transcript_sequences_populated(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        fasta = os.path.join(directory, 'pep.fa')
+        with open(fasta, 'w') as pep:
+            pep.write(">ENSP00000000001.1 pep chromosome:GRCh38:1:1:18:1 gene:ENSG00000000001.1 transcript:ENST00000000001.1\nMK\nVL\n")
+
+        store = SequenceStore(os.path.join(directory, 'sequences.sqlite3'))
+
+        with mock.patch.object(external, 'sequence_store', store), \
+             mock.patch.object(populate_sequence_store, 'sequence_store', store), \
+             mock.patch.object(populate_sequence_store, 'loaded_transcripts', return_value=['ENST01', 'ENST02']), \
+             redirect_stdout(io.StringIO()):
+            call_command('populate_sequence_store', '--release', '95', '--fasta', fasta, '--transcripts')
+
+            external.sequence_cache.clear()
+            self.server.requests.clear()
+
+            # the ENST lookups (e.g. MappingsSerializer.build_mapping) are served by the store
+            self.assertEqual(external.ensembl_sequence('ENST01', 95), GENOMIC_SEQUENCES['ENST01'])
+            self.assertEqual(external.ensembl_sequences(['ENST01', 'ENST02'], 95), GENOMIC_SEQUENCES)
+            self.assertEqual(self.server.requests, [])
+
+        self.assertEqual(store.get('ENSP00000000001', 95), 'MKVL')
+
+    def mapping(self, mapping_id, enst_id):
+        run = SimpleNamespace(score1_type='perfect_match', ensembl_release=95)
+        alignment = SimpleNamespace(alignment_id=mapping_id * 10, alignment_run=run, score1=1)
+
+        return SimpleNamespace(mapping_id=mapping_id,
+                               transcript=SimpleNamespace(enst_id=enst_id),
+                               uniprot=SimpleNamespace(uniprot_acc='P0000{}'.format(mapping_id)),
+                               alignments=SimpleNamespace(all=lambda: [ alignment ]))
+
+    def test_pairwise_many(self):
+        stored = []
+        with mock.patch.object(alignments, 'rendered_pairwise', return_value={}), \
+             mock.patch.object(alignments, 'store_rendered_pairwise', side_effect=stored.extend):
+            results = alignments.fetch_pairwise_many([ self.mapping(1, 'ENST01'), self.mapping(2, 'ENST02') ])
+
+        self.assertEqual([ result['mapping_id'] for result in results ], [1, 2])
+        self.assertEqual(results[1]['alignments'][0]['ensembl_id'], 'ENSP02')
+        self.assertEqual(results[1]['alignments'][0]['match_str'], '||||')
+        self.assertEqual(len(self.posts('/lookup/id')), 1)
+        self.assertEqual(len(self.posts('/sequence/id')), 1)
+        self.assertEqual(sorted(rendered.alignment_id for rendered in stored), [10, 20])
+
+    def test_pairwise_stored_and_invalidated(self):
+        mapping = self.mapping(1, 'ENST01')
+        alignment = mapping.alignments.all()[0]
+        alignment.alignment_run.score1_type = 'identity'
+        alignment.pairwise = SimpleNamespace(cigarplus='4M', mdz='MD:Z:4')
+
+        store = StandInPairwiseStore()
+        with mock.patch.object(EnspUPairwise, 'objects', store):
+            rendered = alignments.fetch_pairwise_many([ mapping ])[0]['alignments'][0]
+            self.assertEqual((rendered['uniprot_alignment'], rendered['match_str']), ('MKVL', '||||'))
+            self.assertEqual(list(store.rows), [ 10 ])
+
+            # read back from the store
+            self.server.requests.clear()
+            self.assertEqual(alignments.fetch_pairwise_many([ mapping ])[0]['alignments'][0], rendered)
+            self.assertEqual(self.server.requests, [])
+
+            # updating the cigar/mdz drops the rendered alignment
+            alignment.pairwise.mdz = 'MD:Z:2A1'
+            serializer = mock.Mock(instance=SimpleNamespace(alignment_id=10))
+            EnspUCigarFetchUpdateByAlignment().perform_update(serializer)
+            serializer.save.assert_called_once_with()
+            self.assertEqual(store.rows, {})
+
+            rendered = alignments.fetch_pairwise_many([ mapping ])[0]['alignments'][0]
+            self.assertEqual((rendered['uniprot_alignment'], rendered['match_str']), ('MKAL', '||:|'))
+            self.assertEqual(store.rows[10].match_str, '||:|')
+
+    def test_pairwise_already_rendered(self):
+        rendered = EnspUPairwise(alignment_id=10, ensp_id='ENSP01', alignment_type='perfect_match',
+                                 uniprot_alignment='MKVL', ensembl_alignment='MKVL', match_str='||||')
+
+        with mock.patch.object(alignments, 'rendered_pairwise', return_value={ 10: rendered }), \
+             mock.patch.object(alignments, 'store_rendered_pairwise') as store:
+            results = alignments.fetch_pairwise_many([ self.mapping(1, 'ENST01') ])
+
+        self.assertEqual(results[0]['alignments'][0]['uniprot_alignment'], 'MKVL')
+        self.assertEqual(self.server.requests, [])
+        store.assert_not_called()
+
+
+class StandInPairwiseQuerySet(list):
+
+    def __init__(self, store, rows):
+        super(StandInPairwiseQuerySet, self).__init__(rows)
+        self.store = store
+
+    def delete(self):
+        for row in self:
+            del self.store.rows[row.alignment_id]
+
+
+class StandInPairwiseStore(object):
+    """
+    Stand-in of the ensp_u_pairwise table, i.e. of the EnspUPairwise.objects
+    queries made to store, read back and invalidate rendered alignments
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def on_conflict(self, fields, action):
+        return self
+
+    def bulk_insert(self, rows):
+        for row in rows:
+            self.rows.setdefault(row['alignment_id'], EnspUPairwise(**row))
+
+    def filter(self, alignment_id__in=(), alignment=None):
+        alignment_ids = set(alignment_id__in) if alignment is None else { alignment }
+
+        return StandInPairwiseQuerySet(self, [ row for alignment_id, row in self.rows.items() if alignment_id in alignment_ids ])
+
+
+class CigarStatsTestCase(SimpleTestCase):
+    """
+    Batch CIGAR statistics (restui.lib.cigar), with NumPy and the pure Python fallback
+    """
+
+    cigars = [ '20M', '5M2I3D8M', '12M1X250M10I3M', '100M25D1000M', '3S10M2X1=4M', '*', '' ]
+
+    def stats(self):
+        fallback = cigar._cigar_stats_python(self.cigars)
+        if cigar.np is None:
+            return [ fallback ]
+
+        vectorised = cigar._cigar_stats_numpy(self.cigars)
+
+        return [ fallback, cigar.CigarStats(*( values.tolist() for values in vectorised )) ]
+
+    def test_differences(self):
+        expected = [ alignments.calculate_difference(cigarplus) for cigarplus in self.cigars ]
+
+        for stats in self.stats():
+            self.assertEqual(stats.differences, expected)
+
+        self.assertEqual(cigar.cigar_differences(self.cigars), expected)
+        self.assertEqual(expected, [ 0, 5, 11, 25, 2, 0, 0 ])
+
+    def test_identity_and_coverage(self):
+        for stats in self.stats():
+            # 5M2I3D8M: 13 matches out of 18 columns, 13 of the 15 query residues aligned
+            self.assertAlmostEqual(stats.identity[1], 13 / 18)
+            self.assertAlmostEqual(stats.coverage[1], 13 / 15)
+
+            # 3S10M2X1=4M: 15 matches out of 17 columns, 17 of the 20 query residues aligned
+            self.assertAlmostEqual(stats.identity[4], 15 / 17)
+            self.assertAlmostEqual(stats.coverage[4], 17 / 20)
+
+            # '*' and empty strings
+            self.assertEqual(stats.identity[5:], [ 0.0, 0.0 ])
+            self.assertEqual(stats.coverage[5:], [ 0.0, 0.0 ])
+
+    def test_empty_batch(self):
+        self.assertEqual(list(cigar.cigar_stats([]).differences), [])
+        self.assertEqual(cigar.cigar_differences([]), [])
+
+    def test_invalid(self):
+        for invalid in ('10M5', '5M2Z', 'M5', '1M;2M'):
+            with self.assertRaisesRegex(ValueError, 'Invalid CIGAR string'):
+                cigar._cigar_stats_python([ '20M', invalid ])
+            with self.assertRaisesRegex(ValueError, 'Invalid CIGAR string'):
+                cigar.cigar_differences([ '20M', invalid ])
+
+    @skipIf(cigar.np is None, "NumPy not available")
+    def test_vectorised_matches_fallback(self):
+        self.assertEqual(self.stats()[0], self.stats()[1])
+
+
+class DivergenceTestCase(SimpleTestCase):
+    """
+    Alignment difference of the mappings, as back-filled by fill_alignment_divergence
+    """
+
+    def test_perfect_match(self):
+        # a perfect match wins over the identity alignments, before or after it
+        self.assertEqual(divergence.mapping_difference([ ('identity', 0.9, '5M2I3M', None), ('perfect_match', 1, None, None), ('identity', 0.8, '3M4X', None) ]), 0)
+        self.assertEqual(divergence.mapping_difference([ ('perfect_match', 0, None, None), ('identity', 0.9, '5M2I3M', None) ]), 2)
+
+    def test_identity(self):
+        # the last identity alignment with a cigar is the one
+        self.assertEqual(divergence.mapping_difference([ ('identity', 0.9, '5M2I3M', None), ('identity', 0.8, '3M4X', None) ]), 4)
+        self.assertEqual(divergence.mapping_difference([ ('identity', 0.9, '5M2I3M', None), ('identity', 0.8, None, None) ]), 2)
+        self.assertEqual(divergence.mapping_difference([ ('identity', 0.9, '5M2I3M', None) ], differences={ '5M2I3M': 7 }), 7)
+
+        # no difference is reported as such only by a perfect match
+        self.assertIsNone(divergence.mapping_difference([ ('identity', 1, '10M', None) ]))
+        self.assertIsNone(divergence.mapping_difference([]))
+
+    def test_current_preferred(self):
+        self.assertEqual(divergence.mapping_difference([ ('identity', 0.9, '5M2I3M', True), ('identity', 0.8, '3M4X', False) ]), 2)
+        self.assertEqual(divergence.mapping_difference([ ('perfect_match', 1, None, False), ('identity', 0.9, '5M2I3M', True) ]), 2)
+        self.assertEqual(divergence.mapping_difference([ ('identity', 0.9, '5M2I3M', False), ('identity', 0.8, '3M4X', False) ]), 4)
+
+    def test_group_mapping_alignments(self):
+        rows = [ (1, 'identity', 0.9, '5M2I3M', True),
+                 (1, 'perfect_match', 1, None, False),
+                 (2, None, None, None, None),
+                 (3, 'identity', 0.8, '3M4X', None),
+                 (4, None, None, None, None),
+                 (5, 'identity', 1, '10M', None),
+                 (5, 'identity', 0.7, '2D8M', None) ]
+
+        chunks = list(divergence.group_mapping_alignments(iter(rows), 2))
+
+        self.assertEqual(chunks, [ [ (1, [ ('identity', 0.9, '5M2I3M', True), ('perfect_match', 1, None, False) ]), (2, []) ],
+                                   [ (3, [ ('identity', 0.8, '3M4X', None) ]), (4, []) ],
+                                   [ (5, [ ('identity', 1, '10M', None), ('identity', 0.7, '2D8M', None) ]) ] ])
+
+        self.assertEqual([ len(chunk) for chunk in divergence.group_mapping_alignments(iter(rows), 5) ], [ 5 ])
+        self.assertEqual(list(divergence.group_mapping_alignments(iter([]), 2)), [])
+
+    def test_checkpoint_resume(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint = os.path.join(directory, 'fill.checkpoint')
+
+        chunks = [ [ (1, []), (2, []) ], [ (3, []) ] ]
+
+        with mock.patch.object(fill_alignment_divergence, 'count_mappings', return_value=3), \
+             mock.patch.object(fill_alignment_divergence, 'stream_mapping_alignments', return_value=iter(chunks)) as stream, \
+             mock.patch.object(fill_alignment_divergence, 'fill_chunk', side_effect=lambda chunk: (chunk[-1][0], len(chunk), 0)), \
+             redirect_stdout(io.StringIO()):
+            call_command('fill_alignment_divergence', '--workers', '1', '--checkpoint', checkpoint)
+
+            self.assertEqual(stream.call_args[1]['after'], 0)
+            with open(checkpoint) as f:
+                self.assertEqual(f.read(), '3')
+
+            stream.return_value = iter([])
+            call_command('fill_alignment_divergence', '--workers', '1', '--checkpoint', checkpoint, '--resume')
+
+            self.assertEqual(stream.call_args[1]['after'], 3)
+
+        command = fill_alignment_divergence.Command()
+        self.assertEqual(command.read_checkpoint(os.path.join(directory, 'missing')), 0)
+
+
+class StandInAlignment(object):
+    """
+    An Alignment with its run and, unless cigarplus is None, its cigar
+    """
+
+    def __init__(self, mapping_id, score1_type, score1, cigarplus, is_current=None):
+        self.mapping_id = mapping_id
+        self.alignment_run = SimpleNamespace(score1_type=score1_type)
+        self.score1 = score1
+        self.cigarplus = cigarplus
+        self.is_current = is_current
+
+    @property
+    def pairwise(self):
+        if self.cigarplus is None:
+            raise EnspUCigar.DoesNotExist()
+
+        return SimpleNamespace(cigarplus=self.cigarplus)
+
+
+class DifferenceResolverTestCase(SimpleTestCase):
+    """
+    Bulk resolution of the mapping differences (Mapping/MappingView.difference)
+    """
+
+    alignments = [ StandInAlignment(1, 'perfect_match', 1, None),
+                   StandInAlignment(1, 'identity', 0.9, '5M2I3M'),
+                   StandInAlignment(2, 'identity', 1, '10M'),
+                   StandInAlignment(3, 'identity', 0.9, '5M2I3M', is_current=True),
+                   StandInAlignment(3, 'perfect_match', 1, None, is_current=False),
+                   StandInAlignment(3, 'identity', 0.8, '3M4X', is_current=False),
+                   StandInAlignment(4, 'identity', 0.8, '3M4X'),
+                   StandInAlignment(4, 'identity', 0.9, None) ]
+
+    def setUp(self):
+        patcher = mock.patch.object(divergence, 'Alignment')
+        self.alignment_model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.query = self.alignment_model.objects.filter
+        self.query.return_value.select_related.return_value.order_by.side_effect = \
+            lambda *args: [ alignment for alignment in self.alignments if alignment.mapping_id in self.query.call_args[1]['mapping_id__in'] ]
+
+    def test_rules(self):
+        differences = divergence.DifferenceResolver().differences([1, 2, 3, 4, 5])
+
+        self.assertEqual(differences, { 1: 0,       # perfect match
+                                        2: None,    # identity with no difference
+                                        3: 2,       # the current alignment only
+                                        4: 4,       # missing cigar skipped
+                                        5: None })  # no alignment
+        self.assertEqual(self.query.call_count, 1)
+        self.query.return_value.select_related.assert_called_once_with('alignment_run', 'pairwise')
+
+    def test_cached_by_resolver(self):
+        resolver = divergence.DifferenceResolver()
+        resolver.differences([1, 2])
+
+        self.assertEqual(resolver.difference(2), None)
+        self.assertEqual(resolver.differences([2, 3]), { 2: None, 3: 2 })
+        self.assertEqual([ set(call[1]['mapping_id__in']) for call in self.query.call_args_list ], [ {1, 2}, {3} ])
+
+    def test_scope(self):
+        with divergence.differences_scope() as resolver:
+            resolver.differences([1, 2, 3])
+            with divergence.differences_scope() as inner:
+                self.assertIs(inner, resolver)
+
+            self.assertIs(divergence.scoped_resolver(), resolver)
+            self.assertEqual(Mapping(mapping_id=3).difference, 2)
+            self.assertEqual(MappingView(mapping_id=1).difference, 0)
+            self.assertEqual(self.query.call_count, 1)
+
+        # nothing is cached outside of a scope
+        self.assertIsNot(divergence.scoped_resolver(), resolver)
+        self.assertEqual(Mapping(mapping_id=3).difference, 2)
+        self.assertEqual(Mapping(mapping_id=3).difference, 2)
+        self.assertEqual(self.query.call_count, 3)
+        self.assertIsNone(MappingView(mapping_id=None).difference)
+
+    def test_scope_per_request(self):
+        def view(request):
+            # twice in the same request, once in the next one
+            return HttpResponse(str([ Mapping(mapping_id=3).difference, MappingView(mapping_id=3).difference ]))
+
+        middleware = DifferencesScopeMiddleware(view)
+
+        self.assertEqual(middleware(RequestFactory().get('/')).content, b'[2, 2]')
+        self.assertEqual(self.query.call_count, 1)
+
+        middleware(RequestFactory().get('/'))
+        self.assertEqual(self.query.call_count, 2)
+
+
+class MappingViewPaginationTestCase(SimpleTestCase):
+    """
+    Cursors, page links and cached counts of the mapping views pagination
+    """
+
+    def request(self, **params):
+        return Request(APIRequestFactory().get('/mappings/', params))
+
+    def paginate(self, request, queryset):
+        paginator = MappingViewFacetPagination()
+        with mock.patch('restui.pagination.search_cache') as cache, \
+             mock.patch('restui.pagination.search_signature', return_value=(1, None, ())), \
+             mock.patch.object(MappingViewFacetPagination, 'create_facets', return_value=[]), \
+             mock.patch.object(MappingView, 'status_histories', return_value={}), \
+             mock.patch.object(MappingView, 'species_histories', return_value={}), \
+             mock.patch('restui.pagination.MappingViewsSerializer.build_mapping_group', side_effect=lambda group, **kwargs: group):
+            cache.get.side_effect = lambda key, default: default
+            paginator.paginate_queryset(queryset, request)
+
+        self.cache = cache
+
+        return paginator
+
+    def keyset_queryset(self, groups, next_cursor=None):
+        queryset = mock.Mock()
+        queryset.estimated_grouped_count.return_value = 1000
+        queryset.grouped_keyset_slice.return_value = (groups, next_cursor)
+
+        return queryset
+
+    def test_cursor(self):
+        paginator = MappingViewFacetPagination()
+
+        self.assertEqual(paginator.decode_cursor(self.request(cursor=paginator.encode_cursor(1234))), 1234)
+        self.assertIsNone(paginator.decode_cursor(self.request(cursor='')))
+        self.assertIsNone(paginator.decode_cursor(self.request()))
+
+        for invalid in ('not base64', paginator.encode_cursor('abc')):
+            with self.assertRaises(NotFound):
+                paginator.decode_cursor(self.request(cursor=invalid))
+
+    def test_cursor_links(self):
+        queryset = self.keyset_queryset({ 9: [], 7: [] }, next_cursor=7)
+        paginator = self.paginate(self.request(cursor='', limit=2, offset=4), queryset)
+
+        queryset.grouped_keyset_slice.assert_called_once_with(None, 2)
+        # the total is estimated, the preceding groups are never counted
+        queryset.grouped_counts.assert_not_called()
+        self.assertEqual((paginator.count, paginator.estimated), (1000, True))
+
+        next_link = urlparse(paginator.get_next_link())
+        self.assertEqual(parse_qs(next_link.query), { 'cursor': [ paginator.encode_cursor(7) ], 'limit': [ '2' ] })
+        self.assertIsNone(paginator.get_previous_link())
+
+        queryset = self.keyset_queryset({ 5: [] })
+        paginator = self.paginate(self.request(cursor=paginator.encode_cursor(7), limit=2), queryset)
+
+        queryset.grouped_keyset_slice.assert_called_once_with(7, 2)
+        self.assertIsNone(paginator.get_next_link())
+
+    def test_estimated_offset_links(self):
+        paginator = MappingViewFacetPagination()
+        paginator.request = self.request(limit=10, offset=20)
+        paginator.cursor_mode, paginator.estimated = False, True
+        paginator.limit, paginator.offset, paginator.has_more = 10, 20, True
+
+        self.assertEqual(parse_qs(urlparse(paginator.get_next_link()).query), { 'limit': [ '10' ], 'offset': [ '30' ] })
+        self.assertEqual(parse_qs(urlparse(paginator.get_previous_link()).query), { 'limit': [ '10' ], 'offset': [ '10' ] })
+
+        paginator.has_more = False
+        self.assertIsNone(paginator.get_next_link())
+
+    def test_counts_cache_size(self):
+        for groups, cached in ((3, True), (settings.SEARCH_CACHE_MAX_GROUPS + 1, False)):
+            queryset = mock.Mock(grouped_count=groups)
+            queryset.grouped_counts.return_value = [ { 'grouping_id': grouping_id, 'total': 1 } for grouping_id in range(groups) ]
+            queryset.grouped_slice.return_value = { 0: [] }
+
+            paginator = self.paginate(self.request(searchTerm='brca', limit=1), queryset)
+
+            self.assertEqual(paginator.count, groups)
+            self.assertEqual(len(queryset._counts), groups)
+            cached_counts = [ entry['counts'] for (_, entry), _ in self.cache.set.call_args_list ]
+            self.assertEqual(any(cached_counts), cached)
+
+
+class SummaryRefreshTestCase(SimpleTestCase):
+    """
+    Background refresh of the mapping_view_facets summary after status updates
+    """
+
+    def test_coalesce(self):
+        started, release, done = threading.Event(), threading.Event(), threading.Event()
+        refreshes = []
+
+        def refresh():
+            refreshes.append(1)
+            started.set()
+            release.wait(5)
+            if len(refreshes) == 2:
+                done.set()
+
+        refresher = facets.SummaryRefresh()
+        with mock.patch('restui.lib.facets.refresh_summary_facets', side_effect=refresh), \
+             mock.patch('restui.lib.facets.connections'):
+            refresher.schedule()
+            self.assertTrue(started.wait(5))
+
+            # updates made during the refresh make a single following one
+            refresher.schedule()
+            refresher.schedule()
+            release.set()
+
+            self.assertTrue(done.wait(5))
+            for _ in range(50):
+                if not refresher._running:
+                    break
+                time.sleep(0.1)
+
+        self.assertEqual(len(refreshes), 2)
+        self.assertFalse(refresher._running)
+
+
+class DeadlineTestCase(SimpleTestCase):
+    """
+    Remote calls bounded by the deadline of the request waiting for them
+    """
+
+    def setUp(self):
+        self.client = HTTPClient(connect_timeout=3, read_timeout=30, retries=3, backoff_factor=0.5)
+
+    def test_timeout(self):
+        with mock.patch.object(self.client.session, 'request') as request:
+            self.client.get('http://ensembl.test/info')
+            self.assertEqual(request.call_args[1]['timeout'], (3, 30))
+
+            with self.client.deadline(concurrency.Deadline(2)):
+                self.client.get('http://ensembl.test/info')
+            connect_timeout, read_timeout = request.call_args[1]['timeout']
+            self.assertLessEqual(connect_timeout, 2)
+            self.assertLessEqual(read_timeout, 2)
+
+            # past the deadline the call isn't even made
+            with self.client.deadline(concurrency.Deadline(0)):
+                with self.assertRaises(requests.Timeout):
+                    self.client.get('http://ensembl.test/info')
+            self.assertEqual(request.call_count, 2)
+
+    def test_stats_logged(self):
+        client = HTTPClient(connect_timeout=3, read_timeout=30, stats_interval=0)
+
+        with mock.patch.object(client.session, 'request', return_value=mock.Mock(ok=False)), \
+             self.assertLogs('gifts_rest.http_client', level='INFO') as logs:
+            client.get('http://ensembl.test/info')
+
+        self.assertEqual(client.stats()['ensembl.test']['errors'], 1)
+        self.assertIn('ensembl.test: 1 requests, 1 errors', logs.output[0])
+
+        # not logged again within the interval, nor when disabled
+        for client in (HTTPClient(connect_timeout=3, read_timeout=30, stats_interval=600), self.client):
+            with mock.patch.object(client, 'log_stats') as log_stats, \
+                 mock.patch.object(client.session, 'request'):
+                client.get('http://ensembl.test/info')
+            log_stats.assert_not_called()
+
+    def test_retries(self):
+        retry = DeadlineRetry(total=3, backoff_factor=1).increment(method='GET', url='/info').increment(method='GET', url='/info')
+        self.assertFalse(retry.is_exhausted())
+
+        # the backoff before the next attempt would go past the deadline
+        with self.client.deadline(concurrency.Deadline(1)):
+            self.assertTrue(retry.is_exhausted())
+        with self.client.deadline(concurrency.Deadline(10)):
+            self.assertFalse(retry.is_exhausted())
+
+    def test_gather(self):
+        late, pending = mock.Mock(), mock.Mock()
+        late.result.side_effect = TimeoutError()
+
+        with self.assertRaises(TimeoutError):
+            concurrency.gather([ late, pending ], concurrency.Deadline(0))
+
+        self.assertTrue(late.cancel.called)
+        pending.cancel.assert_called_once_with()
+        pending.result.assert_not_called()
+
+    def test_expired_deadline(self):
+        fn = mock.Mock()
+        future = concurrency.submit(concurrency.Deadline(0), fn)
+
+        with self.assertRaises(TimeoutError):
+            future.result(timeout=5)
+        fn.assert_not_called()
+
+
+class TaxonomyRegistryTestCase(SimpleTestCase):
+    """
+    Reloads of the taxonomy registry, outside of its lock
+    """
+
+    def test_reload_serves_previous(self):
+        registry = taxonomy.TaxonomyRegistry()
+        loading, release = threading.Event(), threading.Event()
+        snapshots = iter([ ({ 9606: 'v1' }, {}), ({ 9606: 'v2' }, {}) ])
+
+        def load():
+            if registry._histories is not None:
+                loading.set()
+                release.wait(5)
+            return next(snapshots)
+
+        with mock.patch.object(registry, '_load', side_effect=load):
+            self.assertEqual(registry.history(9606), 'v1')
+
+            registry.invalidate()
+            reload = threading.Thread(target=registry.history, args=(9606,))
+            reload.start()
+            self.assertTrue(loading.wait(5))
+
+            # served the previous registry while the reload is running
+            self.assertEqual(registry.history(9606), 'v1')
+            # invalidated again while loading, reloaded on next access
+            registry.invalidate()
+
+            release.set()
+            reload.join(5)
+            self.assertEqual(registry._histories, { 9606: 'v2' })
+            self.assertIsNone(registry._loaded)
+
+
+class SearchStatusHistoryTestCase(SimpleTestCase):
+    """
+    Status history of the mappings in the search results
+    """
+
+    def test_status_history(self):
+        stamp = datetime(2018, 5, 1, tzinfo=timezone.utc)
+        statuses = [ SimpleNamespace(mapping_id=1, status_id=1, time_stamp=stamp, user_stamp_id=None),
+                     SimpleNamespace(mapping_id=1, status_id=2, time_stamp=stamp, user_stamp_id=None) ]
+        group = [ MappingView(id=1, mapping_id=1, grouping_id=7, status=2), MappingView(id=2, mapping_id=2, grouping_id=7, status=1) ]
+
+        with mock.patch('restui.models.mappings.UeMappingStatus.objects') as status_objects, \
+             mock.patch.object(MappingView, '_status_type', { 1: 'NOT_REVIEWED', 2: 'REVIEWED' }), \
+             mock.patch.object(MappingView, '_entry_type', { None: None }), \
+             mock.patch.object(MappingViewsSerializer, 'build_taxonomy_data', return_value={}):
+            status_objects.filter.return_value.order_by.return_value = statuses
+
+            status_histories = MappingView.status_histories([ mapping_view.mapping_id for mapping_view in group ])
+            entries = MappingViewsSerializer.build_mapping_group(group, status_histories=status_histories)['entryMappings']
+
+        # a single query for the whole page
+        status_objects.filter.assert_called_once_with(mapping_id__in=[1, 2])
+        self.assertEqual(entries[0]['status'], 'REVIEWED')
+        self.assertEqual(entries[0]['status_history'], [ { 'status': 'NOT_REVIEWED', 'time_stamp': stamp, 'user': None },
+                                                         { 'status': 'REVIEWED', 'time_stamp': stamp, 'user': None } ])
+        self.assertEqual(entries[1]['status_history'], [])
+
+        serialized = StatusHistorySerializer(entries[0]['status_history'], many=True).data
+        self.assertEqual([ status['status'] for status in serialized ], [ 'NOT_REVIEWED', 'REVIEWED' ])
@@ -63,6 +63,10 @@ urlpatterns = [
     # TODO?
     # path('mapping/<int:pk>/alignment_run/<alignment_run>/difference/')
     path('mapping/<int:pk>/', mappings.MappingDetailed.as_view()),                      # retrieve mapping and related entries
+    path('mappings/lookup/', mappings.MappingViewsLookup.as_view()),                    # bulk lookup of ENSG/ENST/UniProt accessions
+    path('mappings/suggest/', mappings.MappingViewsSuggest.as_view()),                  # search term suggestions (autocomplete)
+    path('mappings/export/', mappings.MappingViewsExport.as_view()),                    # export all the search results (NDJSON/TSV stream)
+    path('mappings/pairwise/', mappings.MappingsPairwiseAlignments.as_view()),          # retrieve pairwise alignments for several mappings
     path('mappings/', mappings.MappingViewsSearch.as_view()),                           # search the mappings (limit/offset paginated results)
 
     path('uniprot/entry/<int:pk>/', uniprot.UniprotEntryFetch.as_view()),               # fetch uniprot entry by db ID
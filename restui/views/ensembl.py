@@ -1,4 +1,4 @@
-from restui.models.ensembl import EnsemblGene, EnsemblTranscript, EnspUCigar, EnsemblSpeciesHistory
+from restui.models.ensembl import EnsemblGene, EnsemblTranscript, EnspUCigar, EnspUPairwise, EnsemblSpeciesHistory
 from restui.serializers.ensembl import EnsemblGeneSerializer, EnspUCigarSerializer, EnsemblReleaseSerializer, SpeciesHistorySerializer, TranscriptSerializer
 from restui.lib.external import ensembl_sequence
 
@@ -166,6 +166,12 @@ class EnspUCigarFetchUpdateByAlignment(generics.RetrieveUpdateAPIView):
 
         return obj
 
+    def perform_update(self, serializer):
+        serializer.save()
+
+        # the rendered pairwise alignment no longer matches the cigar/mdz
+        EnspUPairwise.objects.filter(alignment=serializer.instance.alignment_id).delete()
+
 class LatestEnsemblRelease(APIView):
     """
     Fetch the latest Ensembl release whose load is complete.
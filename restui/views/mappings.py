@@ -1,5 +1,7 @@
+import csv
+import json
+import logging
 import pprint
-import re
 import requests
 import urllib.parse
 from collections import defaultdict, OrderedDict
@@ -13,10 +15,18 @@ from restui.serializers.mappings import MappingByHistorySerializer, ReleaseMappi
     MappingAlignmentsSerializer, CommentLabelSerializer, ReleaseStatsSerializer, ReleasePerSpeciesSerializer, EnsemblUniprotMappingSerializer
 from restui.serializers.annotations import CvUeStatusSerializer, MappingStatusSerializer, MappingCommentSerializer, MappingLabelSerializer, LabelsSerializer
 from restui.pagination import FacetPagination, MappingViewFacetPagination
+from restui.lib.facets import summary_refresh
 from restui.lib.external import ensembl_sequence
-from restui.lib.alignments import fetch_pairwise
-
-from django.http import Http404
+from restui.lib.alignments import fetch_pairwise, fetch_pairwise_many
+from restui.lib.concurrency import Deadline, result, submit
+from restui.lib.detail_cache import invalidate_mapping_detail, mapping_detail_cache
+from restui.lib.search import ENSG_PATTERN, ENST_PATTERN, UNIPROT_PATTERN, invalidate_search_cache, lookup_mapping_views, search_mapping_views
+from restui.lib.suggest import suggest_index
+from restui.lib.taxonomy import taxonomy_registry
+from restui.lib.unit_of_work import UnitOfWork
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, StreamingHttpResponse
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.db.models import Max, F, Q, Count
@@ -30,6 +40,8 @@ from rest_framework.schemas import ManualSchema
 
 import coreapi, coreschema
 
+logger = logging.getLogger(__name__)
+
 def get_mapping(pk):
     try:
         return Mapping.objects.get(pk=pk)
@@ -69,52 +81,66 @@ def get_label(label):
         raise Http404("Couldn't get unique label object for {}".format(label))
     
 def build_taxonomy_data(mapping):
-    # Find the ensembl tax id via one ensembl species history associated to transcript
-    # associated to the given mapping.
-    # Relationship between transcript and history is many to many but we just fetch one history
-    # as the tax id remains the same across all of them
-    try:
-        ensembl_species_history = EnsemblSpeciesHistory.objects.filter(transcripthistory__transcript=mapping.transcript).latest('time_loaded')
-    except EnsemblSpeciesHistory.DoesNotExist:
-        raise Http404("Couldn't find an ensembl species history associated to mapping {}".format(mapping.mapping_id))
-    
+    # Find the ensembl species from the uniprot tax id of the mapping,
+    # the tax id is the same for the transcript and the uniprot entry
     try:
-        return { 'species':ensembl_species_history.species,
-                 'ensemblTaxId':ensembl_species_history.ensembl_tax_id,
-                 'uniprotTaxId':mapping.uniprot.uniprot_tax_id }
+        uniprot_tax_id = mapping.uniprot.uniprot_tax_id
     except:
         raise Http404("Couldn't find uniprot tax id as I couldn't find a uniprot entry associated to the mapping")
 
+    taxonomy = taxonomy_registry.taxonomy(uniprot_tax_id)
+    if taxonomy['species'] is None:
+        raise Http404("Couldn't find an ensembl species history associated to mapping {}".format(mapping.mapping_id))
+
+    return taxonomy
 
-def build_related_mappings_data(mapping):
+
+def build_related_mappings_data(mapping, uow=None):
     """
     Return the list of mappings sharing the same ENST or Uniprot accession of the given mapping.
+
+    The related mappings, their latest mapping history and their status history
+    are loaded in bulk, so the number of queries doesn't depend on the size of the group.
     """
 
+    if uow is None:
+        uow = UnitOfWork()
+
     # related mappings share the same group_id and tax id
-    mapping_mh = mapping.mapping_history.latest('release_mapping_history__time_mapped')
+    mapping_mh = uow.latest_mapping_history(mapping)
     mapping_mh_rmh = mapping_mh.release_mapping_history
     mapping_grouping_id = mapping_mh.grouping_id
 
-    related_mappings_mh = MappingHistory.objects.filter(release_mapping_history=mapping_mh_rmh, grouping_id=mapping_grouping_id)
-    related_mappings = filter(lambda m: m.mapping_id != mapping.mapping_id, ( mh.mapping for mh in related_mappings_mh ) )
+    related_mappings_mh = MappingHistory.objects.filter(release_mapping_history=mapping_mh_rmh, grouping_id=mapping_grouping_id).exclude(
+        mapping_id=mapping.mapping_id).select_related('mapping__uniprot', 'mapping__transcript__gene')
+    related_mappings = [ uow.register(mh.mapping) for mh in related_mappings_mh ]
 
     # mappings = Mapping.objects.filter(mapping_history__grouping_id=mapping.mapping_history.latest('release_mapping_history__time_mapped').grouping_id, uniprot__uniprot_tax_id=mapping.uniprot.uniprot_tax_id).exclude(pk=mapping.mapping_id)
 
-    return list(map(lambda m: MappingsSerializer.build_mapping(m, fetch_sequence=False), related_mappings))
+    related_mapping_ids = set( m.mapping_id for m in related_mappings )
+    mapping_histories = { mapping_id: uow.register(mapping_history)
+                          for mapping_id, mapping_history in Mapping.latest_mapping_histories(related_mapping_ids).items() }
+    status_histories = MappingView.status_histories(related_mapping_ids)
+
+    return [ MappingsSerializer.build_mapping(m, fetch_sequence=False,
+                                              mapping_history=mapping_histories[m.mapping_id],
+                                              status_history=status_histories[m.mapping_id]) for m in related_mappings ]
 
-def build_related_unmapped_entries_data(mapping):
+def build_related_unmapped_entries_data(mapping, uow=None):
     """
     Return the list of unmapped entries releated to the mapping (via grouping_id)
     """
 
+    if uow is None:
+        uow = UnitOfWork()
+
     # related unmapped entries share the same grouping_id and tax id
-    mapping_mh = mapping.mapping_history.latest('release_mapping_history__time_mapped')
+    mapping_mh = uow.latest_mapping_history(mapping)
     mapping_mh_rmh = mapping_mh.release_mapping_history
     mapping_grouping_id = mapping_mh.grouping_id
 
     related_unmapped_ue_histories = UniprotEntryHistory.objects.filter(release_version=mapping_mh_rmh.uniprot_release,
-                                                                       grouping_id=mapping_grouping_id)
+                                                                       grouping_id=mapping_grouping_id).select_related('uniprot')
     related_unmapped_ue_entries = map( lambda ue: { 'uniprot_id':ue.uniprot_id,
                                                     'uniprotAccession': ue.uniprot_acc,
                                                     'entryType': Mapping.entry_type(ue.entry_type_id),
@@ -129,8 +155,8 @@ def build_related_unmapped_entries_data(mapping):
                                                     'length': ue.length,
                                                     'protein_existence_id': ue.protein_existence_id }, ( ueh.uniprot for ueh in related_unmapped_ue_histories ) )
 
-    related_unmapped_transcript_histories = TranscriptHistory.objects.filter(ensembl_species_history=mapping_mh_rmh.ensembl_species_history,
-                                                                             grouping_id=mapping_grouping_id)
+    related_unmapped_transcript_histories = TranscriptHistory.objects.filter(ensembl_species_history_id=mapping_mh_rmh.ensembl_species_history_id,
+                                                                             grouping_id=mapping_grouping_id).select_related('transcript__gene')
     related_unmapped_transcripts = map(lambda transcript: { 'transcript_id':transcript.transcript_id,
                                                             'enstId':transcript.enst_id,
                                                             'enstVersion':transcript.enst_version,
@@ -322,6 +348,8 @@ class MappingLabelView(APIView):
         
         if serializer.is_valid():
             serializer.save()
+            invalidate_mapping_detail(mapping)
+
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -334,6 +362,7 @@ class MappingLabelView(APIView):
         mapping_labels = UeMappingLabel.objects.filter(mapping=mapping,label=label_id)
         if mapping_labels:
             mapping_labels.delete()
+            invalidate_mapping_detail(mapping)
 
             return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -410,6 +439,7 @@ class EditDeleteCommentView(APIView):
             comment.comment = request.data['text']
             comment.time_stamp = timezone.now()
             comment.save()
+            invalidate_mapping_detail(mapping)
 
         serializer = CommentLabelSerializer({ 'commentId': comment.id,
                                               'text': comment.comment,
@@ -428,6 +458,7 @@ class EditDeleteCommentView(APIView):
         else:
             comment.deleted = True
             comment.save()
+            invalidate_mapping_detail(mapping)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
     
@@ -477,6 +508,8 @@ class MappingCommentsView(APIView):
 
         if serializer.is_valid():
             serializer.save()
+            invalidate_mapping_detail(mapping)
+
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -539,6 +572,7 @@ class MappingStatusView(APIView):
         # Update the status in the mapping record
         mapping.status = s
         mapping.save()
+        invalidate_mapping_detail(mapping)
 
         # update status on mapping_view corresponding entry,
         # otherwise search won't reflect the status change
@@ -550,6 +584,11 @@ class MappingStatusView(APIView):
             mv.status = s.id
             mv.save()
 
+        # cached search counts/facets may no longer reflect the status change,
+        # nor the summary the facets of a browse with no search term come from
+        invalidate_search_cache()
+        summary_refresh.schedule()
+
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -582,6 +621,7 @@ class MappingAlignmentDifference(APIView):
 
         mapping.alignment_difference = difference
         mapping.save()
+        invalidate_mapping_detail(mapping)
 
         serializer = EnsemblUniprotMappingSerializer(MappingsSerializer.build_mapping(mapping))
 
@@ -616,6 +656,48 @@ class MappingPairwiseAlignment(APIView):
          
         return Response(serializer.data)
 
+class MappingsPairwiseAlignments(APIView):
+    """
+    Retrieve the pairwise alignments of several mappings, the Ensembl sequences are fetched in batch
+    """
+
+    max_mappings = 100
+
+    schema = ManualSchema(description="Retrieve the pairwise alignments of several mappings, the Ensembl sequences are fetched in batch",
+                          fields=[
+                              coreapi.Field(
+                                  name="ids",
+                                  required=True,
+                                  location="query",
+                                  schema=coreschema.String(),
+                                  description="Comma separated list of mapping IDs (max 100)"
+                              ),])
+
+    def get(self, request):
+        try:
+            mapping_ids = [ int(mapping_id) for mapping_id in request.query_params.get('ids', '').split(',') if mapping_id ]
+        except ValueError:
+            return Response({ "error":"Invalid mapping IDs" }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not mapping_ids:
+            return Response({ "error":"Expected a list of mapping IDs" }, status=status.HTTP_400_BAD_REQUEST)
+        if len(mapping_ids) > self.max_mappings:
+            return Response({ "error":"Too many mapping IDs, max is {}".format(self.max_mappings) }, status=status.HTTP_400_BAD_REQUEST)
+
+        mappings = Mapping.objects.filter(pk__in=mapping_ids).select_related('transcript', 'uniprot').prefetch_related('alignments__alignment_run', 'alignments__pairwise').order_by('mapping_id')
+        if not mappings:
+            raise Http404
+
+        try:
+            alignments = fetch_pairwise_many(mappings)
+        except Exception as e:
+            logger.warning("Cannot render the pairwise alignments of mappings %s: %s", mapping_ids, e)
+            raise Http404
+
+        serializer = MappingAlignmentsSerializer(alignments, many=True)
+
+        return Response(serializer.data)
+
 
 class MappingDetailed(APIView):
     """
@@ -633,15 +715,48 @@ class MappingDetailed(APIView):
                               ),])
 
     def get(self, request, pk):
-        mapping = get_mapping(pk)
+        authenticated = True if request.user and request.user.is_authenticated else False
 
-        data = { 'taxonomy': build_taxonomy_data(mapping),
-                 'mapping': MappingsSerializer.build_mapping(mapping, fetch_sequence=True, authenticated=True if request.user and request.user.is_authenticated else False),
-                 'relatedEntries': { 'mapped': build_related_mappings_data(mapping),
-                                     'unmapped': build_related_unmapped_entries_data(mapping) } }
+        # served from the cache until a write on the mapping or its group (see invalidate_mapping_detail)
+        document = mapping_detail_cache.get(pk, authenticated)
+        if document is not None:
+            return Response(document)
+
+        # fetch the mapping and its histories once for all the helpers
+        uow = UnitOfWork()
+        try:
+            mapping = uow.mapping(pk)
+        except Mapping.DoesNotExist:
+            raise Http404
+
+        mapping_history = uow.last_mapping_history(mapping)
+
+        # fetch the transcript sequence from Ensembl while querying the database
+        deadline = Deadline()
+        sequence_future = submit(deadline, ensembl_sequence, mapping.transcript.enst_id,
+                                 mapping_history.release_mapping_history.ensembl_species_history.ensembl_release)
+
+        taxonomy = build_taxonomy_data(mapping)
+        related_entries = { 'mapped': build_related_mappings_data(mapping, uow),
+                            'unmapped': build_related_unmapped_entries_data(mapping, uow) }
+
+        try:
+            sequence = result(sequence_future, deadline)
+        except Exception as e:
+            logger.warning("Cannot fetch the sequence of %s: %s", mapping.transcript.enst_id, e)
+            sequence = None
+
+        data = { 'taxonomy': taxonomy,
+                 'mapping': MappingsSerializer.build_mapping(mapping, fetch_sequence=sequence is not None, authenticated=authenticated,
+                                                            mapping_history=mapping_history, sequence=sequence),
+                 'relatedEntries': related_entries }
 
         serializer = MappingSerializer(data)
 
+        # don't keep the document without the sequence if it couldn't be fetched
+        if sequence is not None:
+            mapping_detail_cache.set(pk, authenticated, serializer.data)
+
         return Response(serializer.data)
 
 class MappingsSearch(generics.ListAPIView):
@@ -698,12 +813,11 @@ class MappingsSearch(generics.ListAPIView):
                 #  or all 'related' mappings? We're returning only that mapping at the moment
                 queryset = [ get_mapping(search_term) ]
             else: # this is either an ENSG/ENST or UniProt accession or gene name
-                if re.match(r"^ENS[A-Z]*?G[0-9]+?$", search_term, re.I):
+                if ENSG_PATTERN.match(search_term):
                     queryset = Mapping.objects.filter(transcript__gene__ensg_id__iexact=search_term)
-                elif re.match(r"^ENS[A-Z]*?T[0-9]+?$", search_term, re.I):
+                elif ENST_PATTERN.match(search_term):
                     queryset = Mapping.objects.filter(transcript__enst_id__iexact=search_term)
-                elif re.match(r"^([O,P,Q][0-9][A-Z, 0-9]{3}[0-9]|[A-N,R-Z]([0-9][A-Z][A-Z, 0-9]{2}){1,2}[0-9])(-\d+)*$",
-                              search_term, re.I): # looks like a Uniprot accession
+                elif UNIPROT_PATTERN.match(search_term): # looks like a Uniprot accession
                     # filter in order to get the isoforms as well
                     queryset = Mapping.objects.filter(uniprot__uniprot_acc__iregex=r"^"+search_term)
                 else:
@@ -783,96 +897,166 @@ class MappingViewsSearch(generics.ListAPIView):
         # filters for the given query, taking the form facets=organism:9606,status:unreviewed
         facets_params = self.request.query_params.get('facets', None)
 
-        # search the mappings according to the search term 'type'
-        queryset = None
-        if search_term:
-            if re.match(r"^ENS[A-Z]*?G[0-9]+?$", search_term, re.I):
-                queryset = MappingView.objects.filter(ensg_id__iexact=search_term)
-            elif re.match(r"^ENS[A-Z]*?T[0-9]+?$", search_term, re.I):
-                queryset = MappingView.objects.filter(enst_id__iexact=search_term)
-            elif re.match(r"^([O,P,Q][0-9][A-Z, 0-9]{3}[0-9]|[A-N,R-Z]([0-9][A-Z][A-Z, 0-9]{2}){1,2}[0-9])(-\d+)*$",
-                          search_term, re.I): # looks like a Uniprot accession
-                # filter in order to get the isoforms as well
-                queryset = MappingView.objects.filter(uniprot_acc__iregex=r"^"+search_term)
-            else:
-                # should be a search request with a gene symbol (both Uniprot and Ensembl) and possibly name
-                query_filter = Q(gene_symbol_up__iregex=r"^"+search_term)
-                query_filter |= Q(gene_symbol_eg__iregex=r"^"+search_term)
-                query_filter |= Q(gene_name__iregex=r"^"+search_term)
-                queryset = MappingView.objects.filter(query_filter)
+        return search_mapping_views(search_term, facets_params)
+
+
+class MappingViewsLookup(APIView):
+    """
+    Bulk lookup of the mappings of a list of ENSG/ENST IDs and UniProt accessions.
+    """
+
+    schema = ManualSchema(description="Bulk lookup of the mappings of a list of ENSG/ENST IDs and UniProt accessions",
+                          fields=[
+                              coreapi.Field(
+                                  name="identifiers",
+                                  required=True,
+                                  location="body",
+                                  schema=coreschema.Array(items=coreschema.String()),
+                                  description="List of ENSG/ENST IDs and UniProt accessions"
+                              ),])
+
+    max_identifiers = 10000
+
+    def post(self, request):
+        identifiers = request.data
+
+        if not isinstance(identifiers, list) or not all(isinstance(identifier, str) for identifier in identifiers):
+            return Response({ "error":"Expected a list of identifiers" }, status=status.HTTP_400_BAD_REQUEST)
+        if len(identifiers) > self.max_identifiers:
+            return Response({ "error":"Too many identifiers, max is {}".format(self.max_identifiers) }, status=status.HTTP_400_BAD_REQUEST)
+
+        results, unrecognised = lookup_mapping_views(identifiers)
+
+        status_histories = MappingView.status_histories(set( mapping_view.mapping_id for mapping_views in results.values() for mapping_view in mapping_views ))
+
+        data = { 'mappings': { identifier: [ MappingViewsSerializer.build_mapping(mapping_view, status_history=status_histories.get(mapping_view.mapping_id, []))
+                                             for mapping_view in mapping_views ]
+                               for identifier, mapping_views in results.items() },
+                 'unrecognised': unrecognised }
+
+        return Response(data)
+
+
+class MappingViewsSuggest(APIView):
+    """
+    Suggest search terms, i.e. ENSG/ENST IDs, UniProt accessions, gene symbols
+    and names, starting with the given prefix, from an in-memory index.
+    """
+
+    schema = ManualSchema(description="Suggest search terms starting with the given prefix",
+                          fields=[
+                              coreapi.Field(
+                                  name="term",
+                                  required=True,
+                                  location="query",
+                                  schema=coreschema.String(),
+                                  description="The beginning of the search term"
+                              ),
+                              coreapi.Field(
+                                  name="limit",
+                                  required=False,
+                                  location="query",
+                                  schema=coreschema.Integer(),
+                                  description="Max number of suggestions (default 10, max 100)"
+                              ),])
+
+    default_limit = 10
+    max_limit = 100
+
+    def get(self, request):
+        term = request.query_params.get('term', '').strip()
+
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            return Response({ "error":"Invalid limit" }, status=status.HTTP_400_BAD_REQUEST)
+
+        suggestions = suggest_index.suggest(term, limit=limit)
+
+        return Response([ { 'term':suggestion, 'type':suggestion_type } for suggestion, suggestion_type in suggestions ])
+
+
+class Echo(object):
+    """
+    Pseudo-buffer handing back what csv.writer writes to it, to stream the rows
+    """
+
+    def write(self, value):
+        return value
+
+
+class MappingViewsExport(APIView):
+    """
+    Export all the mapping views matching a search, as NDJSON (default) or TSV.
+    Takes the same searchTerm/facets parameters as the mappings search, the rows
+    are streamed from a server-side cursor.
+    """
+
+    schema = ManualSchema(description="Export all the mapping views matching a search",
+                          fields=[
+                              coreapi.Field(
+                                  name="searchTerm",
+                                  required=False,
+                                  location="query",
+                                  schema=coreschema.String(),
+                                  description="ENSG, ENST, UniProt accession, gene symbol or gene name"
+                              ),
+                              coreapi.Field(
+                                  name="facets",
+                                  required=False,
+                                  location="query",
+                                  schema=coreschema.String(),
+                                  description="Filters, e.g. organism:9606,10090;status:unreviewed"
+                              ),
+                              coreapi.Field(
+                                  name="exportFormat",
+                                  required=False,
+                                  location="query",
+                                  schema=coreschema.String(),
+                                  description="Either 'ndjson' (default) or 'tsv'"
+                              ),])
+
+    content_types = { 'ndjson':'application/x-ndjson',
+                      'tsv':'text/tab-separated-values' }
+
+    # number of rows fetched from the server-side cursor at a time
+    chunk_size = 2000
+
+    def get(self, request):
+        export_format = request.query_params.get('exportFormat', 'ndjson').lower()
+        if export_format not in self.content_types:
+            return Response({ "error":"Invalid export format {}".format(export_format) }, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = search_mapping_views(request.query_params.get('searchTerm', None),
+                                        request.query_params.get('facets', None))
+
+        columns = [ field.attname for field in MappingView._meta.concrete_fields ]
+        rows = queryset.order_by('-grouping_id', 'id').values_list(*columns).iterator(chunk_size=self.chunk_size)
+
+        if export_format == 'ndjson':
+            content = self.ndjson(columns, rows)
         else:
-            # no search term: return all mappings
-            queryset = MappingView.objects.all()
+            content = self.tsv(columns, rows)
 
-        #
-        # Apply filters based on facets parameters
-        #
-        if facets_params:
-            # NOTE: must unquote as apparently the browser does not decode
-            facets_params = urllib.parse.unquote(facets_params)
+        response = StreamingHttpResponse(content, content_type=self.content_types[export_format])
+        response['Content-Disposition'] = 'attachment; filename="mappings.{}"'.format(export_format)
 
-            # create facets dict from e.g. 'organism:9606,10090;status:unreviewed;chromosome:10,11,X'
-            facets = dict( tuple(param.split(':')) for param in facets_params.split(';') )
+        return response
 
-            queryset = queryset.all()
+    @staticmethod
+    def export_row(columns, row):
+        entry = OrderedDict(zip(columns, row))
+        entry['status'] = MappingView.status_description(entry['status'])
 
-            # filter based on species
-            if 'organism' in facets:
-                # consider query may request for multiple organisms
-                queryset = queryset.filter(uniprot_tax_id__in=facets['organism'].split(','))
-
-            # filter on how large a difference between the pairwise
-            # aligned protein sequences is, if there is an alignment
-            if 'alignment' in facets:
-                # consider query may request for multiple alignment differences
-                alignment_diff_filter = Q()
-
-                for diff in facets['alignment'].split(','):
-                    if diff == 'identical':
-                        alignment_diff_filter |= Q(alignment_difference=0)
-                    elif diff == 'small':
-                        alignment_diff_filter |= Q(alignment_difference__gt=0, alignment_difference__lte=5)
-                    elif diff == 'large':
-                        alignment_diff_filter |= Q(alignment_difference__gt=5)
-
-                queryset = queryset.filter(alignment_diff_filter)
-
-            # filter based on status
-            if 'status' in facets:
-                # possible multiple statuses
-                status_filter = Q()
-
-                for status_description in facets['status'].split(','):
-                    try:
-                        status_id = CvUeStatus.objects.get(description=status_description.upper()).id
-                    except:
-                        # TODO Should be a 400, how do we make this work with pagination?
-                        # return Response(status=status.HTTP_400_BAD_REQUEST)
-                        raise Http404("Invalid status type")
-                    else:
-                        status_filter |= Q(status=status_id)
-
-                queryset = queryset.filter(status_filter)
-
-            # filter based on chromosomes
-            if 'chromosomes' in facets:
-                # possible multiple chromosomes
-                queryset = queryset.filter(chromosome__in=facets['chromosomes'].split(','))
-
-            # filter based on entry type
-            if 'type' in facets:
-                # possible multiple types
-                queryset = queryset.filter(uniprot_mapping_status__in=facets['type'].split(','))
-
-            # filter out entries on patches
-            if 'patches' in facets:
-                # options, should be mutually exclusive
-                # - 1: include patches
-                # - 2: exclude patches
-                # - 3: include only patches
-                if facets["patches"] == 'exclude':
-                    queryset = queryset.exclude(region_accession__iregex=r"^CHR")
-                elif facets["patches"] == 'only':
-                    queryset = queryset.filter(region_accession__iregex=r"^CHR")
+        return entry
 
-        return queryset
+    def ndjson(self, columns, rows):
+        for row in rows:
+            yield json.dumps(self.export_row(columns, row), cls=DjangoJSONEncoder) + '\n'
+
+    def tsv(self, columns, rows):
+        writer = csv.writer(Echo(), delimiter='\t', lineterminator='\n')
+
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow([ '' if value is None else value for value in self.export_row(columns, row).values() ])
@@ -7,6 +7,8 @@ from restui.serializers.unmapped import UnmappedEntrySerializer, UnmappedSwisspr
     CommentSerializer, UnmappedEntryCommentsSerializer
 from restui.serializers.annotations import LabelsSerializer, UnmappedEntryLabelSerializer, UnmappedEntryCommentSerializer, UnmappedEntryStatusSerializer
 from restui.pagination import UnmappedEnsemblEntryPagination
+from restui.lib.facets import summary_refresh
+from restui.lib.search import invalidate_search_cache
 
 from django.utils import timezone
 from django.http import Http404
@@ -446,4 +448,9 @@ class StatusChange(APIView):
             mv.status = s.id
             mv.save()
 
+        # cached search counts/facets may no longer reflect the status change,
+        # nor the summary the facets of a browse with no search term come from
+        invalidate_search_cache()
+        summary_refresh.schedule()
+
         return Response(serializer.data, status=status.HTTP_201_CREATED)
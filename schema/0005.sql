@@ -0,0 +1,21 @@
+--
+-- Indexes supporting the mapping_view searches
+--
+-- Django iexact/istartswith lookups are translated to UPPER(field::text) = UPPER(term)
+-- and UPPER(field::text) LIKE UPPER('term%'), text_pattern_ops lets the latter
+-- use the index whatever the database collation
+--
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS mapping_view_upper_ensg_id_idx ON ensembl_gifts.mapping_view USING btree (upper(ensg_id::text));
+CREATE INDEX IF NOT EXISTS mapping_view_upper_enst_id_idx ON ensembl_gifts.mapping_view USING btree (upper(enst_id::text));
+
+CREATE INDEX IF NOT EXISTS mapping_view_upper_uniprot_acc_like_idx ON ensembl_gifts.mapping_view USING btree (upper(uniprot_acc::text) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS mapping_view_upper_gene_symbol_up_like_idx ON ensembl_gifts.mapping_view USING btree (upper(gene_symbol_up::text) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS mapping_view_upper_gene_symbol_eg_like_idx ON ensembl_gifts.mapping_view USING btree (upper(gene_symbol_eg::text) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS mapping_view_upper_gene_name_like_idx ON ensembl_gifts.mapping_view USING btree (upper(gene_name::text) text_pattern_ops);
+
+ANALYZE ensembl_gifts.mapping_view;
+
+COMMIT;
@@ -0,0 +1,13 @@
+--
+-- Index supporting the bulk lookup of mapping_view by UniProt accession,
+-- where a canonical accession also matches its isoforms, i.e.
+-- UPPER(split_part(uniprot_acc, '-', 1)) IN (...)
+--
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS mapping_view_upper_uniprot_base_acc_idx ON ensembl_gifts.mapping_view USING btree (upper(split_part(uniprot_acc::text, '-', 1)));
+
+ANALYZE ensembl_gifts.mapping_view;
+
+COMMIT;
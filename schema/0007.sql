@@ -0,0 +1,23 @@
+--
+-- Rendered pairwise alignments (see restui.lib.alignments.fetch_pairwise_many),
+-- i.e. the UniProt/Ensembl/match strings built from the ensp_u_cigar
+-- cigarplus/mdz and the Ensembl protein sequence, filled on first request
+-- or with the render_pairwise_alignments command.
+-- The strings are TOASTed, hence stored compressed.
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ensembl_gifts.ensp_u_pairwise (
+    alignment_id bigint NOT NULL,
+    ensp_id character varying(30) NOT NULL,
+    alignment_type character varying(30) NOT NULL,
+    uniprot_alignment text NOT NULL,
+    ensembl_alignment text NOT NULL,
+    match_str text NOT NULL,
+    time_rendered timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT ensp_u_pairwise_pkey PRIMARY KEY (alignment_id),
+    CONSTRAINT ensp_u_pairwise_alignment_id_fkey FOREIGN KEY (alignment_id) REFERENCES ensembl_gifts.alignment(alignment_id) ON DELETE CASCADE
+);
+
+COMMIT;
@@ -0,0 +1,26 @@
+--
+-- Summary of mapping_view by the columns its facets are computed from and
+-- filtered on (see restui.lib.facets), so that the facets of a browse with
+-- no search term don't need a pass over the whole of mapping_view.
+--
+-- The values are reduced to what the facets tell apart, so that the facet
+-- filters select the same rows here as in mapping_view:
+-- - alignment_difference is capped at 6, i.e. any large difference
+-- - region_accession is 'CHR' for the entries on patches, NULL otherwise
+--
+-- Refresh after mapping_view has been (re)loaded, or after the alignment
+-- divergence has been back-filled, with the refresh_mapping_view_facets command.
+--
+
+BEGIN;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS ensembl_gifts.mapping_view_facets AS
+SELECT ROW_NUMBER() OVER () AS id, summary.*
+  FROM (SELECT uniprot_tax_id, status, uniprot_mapping_status, chromosome,
+               CASE WHEN alignment_difference > 6 THEN 6 ELSE alignment_difference END AS alignment_difference,
+               CASE WHEN region_accession ~* '^CHR' THEN 'CHR' END AS region_accession,
+               COUNT(*) AS total
+          FROM ensembl_gifts.mapping_view
+         GROUP BY 1, 2, 3, 4, 5, 6) AS summary;
+
+COMMIT;
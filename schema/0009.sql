@@ -0,0 +1,14 @@
+--
+-- Index supporting the grouped pagination of mapping_view, i.e. the range
+-- scans on grouping_id (descending, NULLS FIRST) of the keyset pages
+-- (see restui.models.mappings.MappingViewQuerySet.grouped_keyset_slice)
+-- and the distinct grouping_id lookups of grouped_offset_slice.
+--
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS mapping_view_grouping_id_idx ON ensembl_gifts.mapping_view USING btree (grouping_id DESC NULLS FIRST);
+
+ANALYZE ensembl_gifts.mapping_view;
+
+COMMIT;
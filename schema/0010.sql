@@ -0,0 +1,14 @@
+--
+-- Version of the mapping search caches (see restui.lib.search), shared by
+-- all the processes serving the API: bumped whenever the status of mapping_view
+-- entries changes, the cached search counts and facets are keyed by it.
+--
+
+BEGIN;
+
+CREATE SEQUENCE IF NOT EXISTS ensembl_gifts.search_cache_version_seq;
+
+-- last_value stays the same on the first nextval otherwise
+SELECT nextval('ensembl_gifts.search_cache_version_seq');
+
+COMMIT;
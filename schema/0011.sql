@@ -0,0 +1,12 @@
+--
+-- Unique index of the mapping_view_facets summary (see schema/0008.sql),
+-- required to refresh it concurrently, i.e. without blocking the facets
+-- served from the previous summary, when mapping_view statuses are updated
+-- (see restui.lib.facets.SummaryRefresh).
+--
+
+BEGIN;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mapping_view_facets_id_idx ON ensembl_gifts.mapping_view_facets USING btree (id);
+
+COMMIT;